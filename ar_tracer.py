@@ -0,0 +1,18 @@
+import os
+
+import streamlit.components.v1 as components
+
+# --- AR TRACING COMPONENT ---
+# Camera view with the traced overlay on top. A declared (bidirectional)
+# component rather than components.html, so the page can ask the server for a
+# sharper overlay level (overlay.get_overlay_level) when the user zooms in, or
+# page to another mural tile (mural.get_tile) without reloading.
+_component = components.declare_component(
+    "ar_tracer", path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "ar_tracer"))
+
+
+# Returns {"level": n, "tile": i} once the page wants a sharper level or
+# another mural tile, else None
+def ar_tracer(src, level, sides, shape, tile=0, tiles=1, tile_name="", key=None):
+    return _component(src=src, level=level, sides=sides, width=shape[1], height=shape[0],
+                      tile=tile, tiles=tiles, tile_name=tile_name, key=key, default=None)
@@ -0,0 +1,153 @@
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+
+import processing
+import streaming
+import tiling
+
+# Headless batch processing: same pipeline as the Streamlit app, no UI.
+#   python batch.py photos/ -o traced/ --style "Pencil Sketch" --workers 8
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".ppm")
+
+
+def find_inputs(patterns):
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for name in sorted(os.listdir(pattern)):
+                if name.lower().endswith(EXTENSIONS):
+                    yield os.path.join(pattern, name)
+        else:
+            yield from sorted(p for p in glob.glob(pattern) if p.lower().endswith(EXTENSIONS))
+
+def render_params(args):
+    return (args.rotation, tuple(args.crop), args.style, args.t1, args.t2,
+            args.brightness, args.contrast, args.grid)
+
+def output_path(path, args):
+    # The name keeps the source extension and carries a short hash of the source
+    # path and every setting that changes the pixels: photo.jpg and photo.png,
+    # or a/x.jpg and b/x.jpg, never share an output, and a run with different
+    # settings never counts an old output as up to date
+    stem, ext = os.path.splitext(os.path.basename(path))
+    style = args.style.lower().replace(" ", "-")
+    if args.style == "Abstract" and args.abstract_tier != "quality":
+        style += f"-{args.abstract_tier}"
+    settings = processing.stage_key(os.path.abspath(path), "output", render_params(args), args.abstract_tier,
+                                    args.working_mp, args.stream)[:8]
+    return os.path.join(args.output, f"{stem}-{ext.lstrip('.').lower()}_{style}_{settings}.{args.format}")
+
+def is_up_to_date(src, dst):
+    return os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src)
+
+def init_worker(working_mp):
+    # One image per process: no intra-image threads, no cross-image cache
+    cv2.setNumThreads(1)
+    tiling.WORKERS = 1
+    processing.stage_cache.max_bytes = 0
+    if working_mp is not None:
+        processing.WORKING_PIXELS = int(working_mp * 1_000_000)
+
+def process_file(src, dst, params, stream_budget=None, abstract_tier=None):
+    start = time.perf_counter()
+    tmp = f"{dst}.tmp{os.path.splitext(dst)[1]}"
+    if stream_budget:
+        # Out of core: strips straight from the file into a mapped TIFF
+        oh, ow = streaming.stream_render(src, tmp, *params, budget=stream_budget, abstract_tier=abstract_tier)
+        os.replace(tmp, dst)
+        return oh * ow / 1e6, time.perf_counter() - start
+    with open(src, "rb") as f:
+        img_cv = processing.ingest_image(f.read())
+    result = processing.apply_processing(img_cv, *params, abstract_tier=abstract_tier)
+    # Black-and-white results (Magic Outline) are written 1 bit per pixel where the format allows
+    flags = [cv2.IMWRITE_PNG_BILEVEL, 1] if dst.endswith(".png") and processing.bit_depth(result) == 1 else []
+    if not cv2.imwrite(tmp, result, flags):
+        raise ValueError(f"Could not write {dst}")
+    os.replace(tmp, dst)
+    return img_cv.shape[0] * img_cv.shape[1] / 1e6, time.perf_counter() - start
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Batch-generate Glass Canvas tracing references.")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("--style", choices=processing.STYLES, default="Original")
+    parser.add_argument("--rotation", type=int, default=0, help="quarter turns counter-clockwise")
+    parser.add_argument("--crop", type=int, nargs=4, default=[0, 0, 0, 0], metavar=("LEFT", "RIGHT", "TOP", "BOTTOM"),
+                        help="crop percentages (0-50)")
+    parser.add_argument("--brightness", type=int, default=0)
+    parser.add_argument("--contrast", type=float, default=1.0)
+    parser.add_argument("--t1", type=int, default=50, help="Magic Outline min threshold")
+    parser.add_argument("--t2", type=int, default=150, help="Magic Outline max threshold")
+    parser.add_argument("--grid", action="store_true", help="draw 3x3 grid lines")
+    parser.add_argument("--abstract-tier", choices=processing.ABSTRACT_TIERS, default=processing.ABSTRACT_TIER,
+                        help="Abstract engine: fast and balanced approximate quality")
+    parser.add_argument("--format", choices=["png", "jpg", "webp", "tif"], default="png")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--working-mp", type=float, default=None,
+                        help="decode JPEGs at reduced size down to this many megapixels")
+    parser.add_argument("--force", action="store_true", help="reprocess up-to-date outputs")
+    parser.add_argument("--stream", action="store_true",
+                        help="render at full resolution in strips (writes TIFF); memory stays within "
+                             "the budget for uncompressed TIFF/BMP/PPM inputs, JPEG/PNG are decoded whole")
+    parser.add_argument("--budget-mb", type=int, default=streaming.STREAM_BUDGET_BYTES >> 20,
+                        help="per-worker memory budget for --stream")
+    args = parser.parse_args(argv)
+    if args.stream:
+        args.format = "tif"
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.output, exist_ok=True)
+    params = render_params(args)
+    stream_budget = args.budget_mb * 1024 * 1024 if args.stream else None
+
+    done = skipped = failed = 0
+    megapixels = 0.0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=(args.working_mp,)) as pool:
+        pending = {}
+        seen = set()
+        inputs = find_inputs(args.inputs)
+        while True:
+            # Keep a bounded number of jobs in flight and write each result as
+            # soon as it finishes, so memory doesn't grow with the input set
+            for src in inputs:
+                dst = output_path(src, args)
+                if dst in seen:
+                    continue  # the same file matched by more than one input pattern
+                seen.add(dst)
+                if not args.force and is_up_to_date(src, dst):
+                    skipped += 1
+                    continue
+                pending[pool.submit(process_file, src, dst, params, stream_budget, args.abstract_tier)] = src
+                if len(pending) >= 2 * args.workers:
+                    break
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                src = pending.pop(future)
+                try:
+                    mp, elapsed = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"FAILED {src}: {e}", file=sys.stderr)
+                    continue
+                done += 1
+                megapixels += mp
+                print(f"{src} -> {output_path(src, args)} ({mp:.1f} MP, {elapsed:.2f}s)")
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{done} processed, {skipped} up to date, {failed} failed in {elapsed:.2f}s "
+          f"({done / elapsed:.2f} images/s, {megapixels / elapsed:.2f} MP/s)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
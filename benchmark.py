@@ -0,0 +1,329 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import overlay
+import processing
+import tiling
+
+# Reproducible per-stage benchmark of the processing core.
+#   python benchmark.py --sizes 1 12 --styles Original Abstract
+#   python benchmark.py --save-baseline          # record this machine's numbers
+#   python benchmark.py                          # fails if a stage regressed or tiled Abstract drifted
+#   python benchmark.py --app --sizes 12         # plus app cold start and rerun latency
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+
+# --- TEST IMAGES ---
+def make_image(megapixels, kind, color, seed=0):
+    rng = np.random.default_rng(seed)
+    w = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    h = int(round(w * 3 / 4))
+    if kind == "synthetic":
+        img = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+    else:
+        # "photo": smooth low-frequency colour field, hard-edged shapes and
+        # sensor-like noise, which is what the edge and smoothing filters see
+        img = cv2.resize(rng.integers(0, 256, (12, 16, 3), dtype=np.uint8), (w, h), interpolation=cv2.INTER_CUBIC)
+        for _ in range(40):
+            center = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+            radius = int(rng.integers(w // 50, w // 8))
+            cv2.circle(img, center, radius, rng.integers(0, 256, 3).tolist(), -1)
+        noise = rng.normal(0, 6, (h, w, 1)).astype(np.int16)
+        img = np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    if not color:
+        img = cv2.cvtColor(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR)
+    return img
+
+
+# --- MEASUREMENT ---
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # No /proc: fall back to the lifetime peak (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PeakRSS:
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(0.001):
+            self.peak = max(self.peak, current_rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def time_stage(fn, repeat):
+    times = []
+    with PeakRSS() as rss:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, rss.peak, rss.peak - rss.start
+
+
+def ssim(a, b):
+    # Mean SSIM on luma (Wang et al. 2004: 11x11 Gaussian window, sigma 1.5)
+    if a.ndim > 2: a = cv2.cvtColor(a, cv2.COLOR_BGR2GRAY)
+    if b.ndim > 2: b = cv2.cvtColor(b, cv2.COLOR_BGR2GRAY)
+    a, b = a.astype(np.float32), b.astype(np.float32)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    blur = lambda x: cv2.GaussianBlur(x, (11, 11), 1.5)
+    ma, mb = blur(a), blur(b)
+    va, vb, cov = blur(a * a) - ma * ma, blur(b * b) - mb * mb, blur(a * b) - ma * mb
+    return float((((2 * ma * mb + c1) * (2 * cov + c2)) / ((ma * ma + mb * mb + c1) * (va + vb + c2))).mean())
+
+
+def tier_similarity(img):
+    # How close the fast Abstract tiers get to the original mean shift output
+    enhanced = processing.adjust_brightness_contrast(img, 1.2, 20)
+    reference = processing.apply_style(enhanced, "Abstract", 50, 150)
+    scores = {}
+    for tier in processing.ABSTRACT_TIERS:
+        if tier != "quality":
+            out = processing.apply_style(enhanced, "Abstract", 50, 150, tier=tier)
+            scores[f"style:Abstract/{tier}"] = {"ssim": round(ssim(reference, out), 4),
+                                                "psnr": round(cv2.PSNR(reference, out), 2)}
+    return scores
+
+
+def tile_drift(img):
+    # Tiled Abstract against the monolithic mean shift (the app's tiled path, forced to 2 workers)
+    enhanced = processing.adjust_brightness_contrast(img, 1.2, 20)
+    reference = processing.abstract_filter(enhanced)
+    tiled = tiling.run_tiled(processing.abstract_filter, enhanced, processing.style_halo("Abstract"),
+                             workers=2, align=processing.style_align("Abstract"))
+    diff = cv2.absdiff(reference, tiled).max(axis=2)
+    return {"style:Abstract": {"tile_diff_pct": round(np.count_nonzero(diff) / diff.size * 100, 4),
+                               "tile_max_diff": int(diff.max())}}
+
+
+def check_tiling(report):
+    pct, levels = processing.ABSTRACT_TILE_TOLERANCE
+    failures = [r for r in report["results"]
+                if r.get("tile_diff_pct", 0) > pct or r.get("tile_max_diff", 0) > levels]
+    for r in failures:
+        print(f"TILE DRIFT {r['case']} {r['stage']}: {r['tile_diff_pct']}% of pixels differ, "
+              f"up to {r['tile_max_diff']} levels (allowed {pct}%, {levels})", file=sys.stderr)
+    return failures
+
+
+def stage_functions(img, styles):
+    ok, jpeg = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    jpeg = jpeg.tobytes()
+    enhanced = processing.adjust_brightness_contrast(img, 1.2, 20)
+    processing.register_source(img, f"bench-{id(img)}")  # keep content hashing out of the encode timing
+
+    stages = {
+        "ingest": lambda: processing.decode_image(jpeg),
+        "rotate_image": lambda: np.ascontiguousarray(processing.rotate_image(img, 1)),
+        "crop_image": lambda: np.ascontiguousarray(processing.crop_image(img, 10, 10, 10, 10)),
+        "adjust_brightness_contrast": lambda: processing.adjust_brightness_contrast(img, 1.2, 20),
+    }
+    for mode in styles:
+        if mode in processing.POINT_MODES:
+            stages[f"style:{mode}"] = lambda mode=mode: processing.apply_point_ops(img, mode, 1.2, 20)
+        else:
+            stages[f"style:{mode}"] = lambda mode=mode: processing.apply_style(enhanced, mode, 50, 150)
+        if mode == "Magic Outline":
+            # A threshold change with the gradients already cached
+            grad = processing.outline_gradients(enhanced)
+            stages["style:Magic Outline/thresholds"] = lambda: processing.outline_edges(grad, 60, 160)
+        if mode == "Abstract":
+            for tier in processing.ABSTRACT_TIERS:
+                if tier != "quality":
+                    stages[f"style:Abstract/{tier}"] = lambda tier=tier: processing.apply_style(
+                        enhanced, "Abstract", 50, 150, tier=tier)
+    stages["draw_grid"] = lambda: processing.draw_grid(img)
+    stages["get_image_base64"] = lambda: overlay.get_image_base64(img)
+    return stages
+
+
+def run(args):
+    # Measure raw stage cost, not cache hits
+    processing.stage_cache.max_bytes = 0
+    overlay.encode_cache.max_bytes = 0
+    results = []
+    for mp in args.sizes:
+        for kind in args.kinds:
+            for color in args.colors:
+                case = f"{kind}-{color}-{mp:g}MP"
+                img = make_image(mp, kind, color == "color", seed=args.seed)
+                actual_mp = img.shape[0] * img.shape[1] / 1e6
+                scores = {}
+                if "Abstract" in args.styles:
+                    scores.update(tier_similarity(img))
+                    scores.update(tile_drift(img))
+                for stage, fn in stage_functions(img, args.styles).items():
+                    ms, peak, delta = time_stage(fn, args.repeat)
+                    results.append({
+                        "case": case, "stage": stage, "megapixels": round(actual_mp, 3),
+                        "ms": round(ms, 3), "ms_per_mp": round(ms / actual_mp, 3),
+                        "peak_rss_mb": round(peak / 2**20, 1), "rss_delta_mb": round(delta / 2**20, 1),
+                        **scores.get(stage, {}),
+                    })
+                    score = scores.get(stage)
+                    print(f"{case:<24} {stage:<28} {ms:>10.1f} ms {ms / actual_mp:>9.2f} ms/MP "
+                          f"{peak / 2**20:>8.0f} MB peak"
+                          + (f"  SSIM {score['ssim']:.3f} PSNR {score['psnr']:.1f} dB" if score and "ssim" in score else "")
+                          + (f"  tiled: {score['tile_diff_pct']}% differ, max {score['tile_max_diff']}"
+                             if score and "tile_diff_pct" in score else ""), flush=True)
+                del img
+    return {
+        "meta": {
+            "python": platform.python_version(), "opencv": cv2.__version__, "numpy": np.__version__,
+            "machine": platform.machine(), "cpus": os.cpu_count(), "repeat": args.repeat, "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+# --- APP STARTUP AND RERUNS ---
+COLD_START_SCRIPT = """
+import json, time
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+AppTest.from_file("app.py", default_timeout=120).run()
+print(json.dumps({"first_run_ms": (time.perf_counter() - start) * 1000}))
+"""
+
+
+def time_reruns(at, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+    return statistics.median(times) * 1000
+
+
+def run_app(args):
+    # Cold start runs in fresh interpreters (Streamlit itself imported before
+    # the clock starts); reruns use AppTest in this process
+    import subprocess
+    from streamlit.testing.v1 import AppTest
+
+    # run() disabled the caches to time raw stages; the app relies on them
+    processing.stage_cache.max_bytes = processing.CACHE_BUDGET_BYTES
+    overlay.encode_cache.max_bytes = overlay.ENCODE_BUDGET_BYTES
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    cold = []
+    for _ in range(args.repeat):
+        out = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], cwd=root, check=True,
+                             capture_output=True, text=True).stdout
+        cold.append(json.loads(out.strip().splitlines()[-1])["first_run_ms"])
+
+    at = AppTest.from_file(os.path.join(root, "app.py"), default_timeout=120)
+    at.run()
+    step1 = time_reruns(at, args.repeat * 5)
+
+    img = make_image(args.sizes[0], "photo", True, seed=args.seed)
+    at.session_state.images.put("processed_image", img)
+    at.session_state.step = 3
+    at.run()  # first step-3 run encodes the overlay
+    step3 = time_reruns(at, args.repeat * 5)
+
+    results = []
+    for stage, ms in [("cold_start", statistics.median(cold)), ("step1_rerun", step1), ("step3_rerun", step3)]:
+        results.append({"case": "app", "stage": stage, "megapixels": None, "ms": round(ms, 3), "ms_per_mp": None})
+        print(f"{'app':<24} {stage:<28} {ms:>10.1f} ms", flush=True)
+    return results
+
+
+def compare(report, baseline, threshold, min_ms):
+    def cost(r):
+        return r["ms_per_mp"] if r["ms_per_mp"] is not None else r["ms"]
+
+    base = {(r["case"], r["stage"]): r for r in baseline["results"]}
+    regressions = []
+    for r in report["results"]:
+        old = base.get((r["case"], r["stage"]))
+        if old is None:
+            continue
+        # Ignore sub-millisecond jitter on the tiny stages
+        if cost(r) > cost(old) * (1 + threshold) and r["ms"] - old["ms"] > min_ms:
+            regressions.append((r, old))
+    for r, old in regressions:
+        unit = "ms/MP" if r["ms_per_mp"] is not None else "ms"
+        print(f"REGRESSION {r['case']} {r['stage']}: {cost(old):.2f} -> {cost(r):.2f} {unit} "
+              f"(+{(cost(r) / cost(old) - 1) * 100:.0f}%)", file=sys.stderr)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every Glass Canvas processing stage.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 12, 48], help="megapixels")
+    parser.add_argument("--kinds", nargs="+", choices=["synthetic", "photo"], default=["synthetic", "photo"])
+    parser.add_argument("--colors", nargs="+", choices=["color", "gray"], default=["color", "gray"])
+    parser.add_argument("--styles", nargs="+", choices=processing.STYLES, default=processing.STYLES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="bench_results.json")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed ms/MP slowdown (0.25 = 25%%)")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="ignore slowdowns smaller than this")
+    parser.add_argument("--app", action="store_true",
+                        help="also time app cold start and step 1/3 reruns (needs streamlit)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    if args.app:
+        report["results"] += run_app(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+    if check_tiling(report):
+        print("Tiled Abstract drifted past processing.ABSTRACT_TILE_TOLERANCE", file=sys.stderr)
+        return 1
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        # A check that can't run must not pass: record one explicitly first
+        print(f"No baseline at {args.baseline}; record one on this machine with --save-baseline",
+              file=sys.stderr)
+        return 2
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(report, baseline, args.threshold, args.min_ms)
+    if regressions:
+        print(f"{len(regressions)} stage(s) regressed by more than {args.threshold:.0%}", file=sys.stderr)
+        return 1
+    print("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+import os
+
+import streamlit.components.v1 as components
+
+# --- CLIENT-SIDE POINT PREVIEW ---
+# Point styles (POINT_MODES) are per-pixel maps of the geometry-adjusted image,
+# so the browser can redo them on a canvas while the sliders move. The server
+# sends the base image once per geometry and only hears back on commit.
+CLIENT_PREVIEW = os.environ.get("GLASS_CANVAS_CLIENT_PREVIEW", "1") == "1"
+
+_component = components.declare_component(
+    "point_preview", path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "point_preview"))
+
+
+# Returns {brightness, contrast, grid, nonce} once the user commits, else None
+def point_preview(src, mode, brightness=0, contrast=1.0, grid=False, key=None):
+    return _component(src=src, mode=mode, brightness=brightness, contrast=contrast, grid=grid,
+                      key=key, default=None)
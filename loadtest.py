@@ -0,0 +1,359 @@
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import cv2
+import requests
+from websockets.sync.client import connect
+
+from benchmark import make_image
+
+# Concurrent-session load test of one replica. Starts `streamlit run app.py`
+# headless on a local port and drives N sessions through the three-step flow
+# over the same websocket protocol the browser uses: upload, move controls
+# across styles, enter AR mode, zoom the overlay. Offline and seeded, so two
+# runs with the same arguments make the same moves.
+#   python loadtest.py --sessions 1 2 4 8             # ramp, one fresh server per level
+#   python loadtest.py --sessions 8 --actions 30 --seed 1 -o load.json
+# Server settings come from the environment (GLASS_CANVAS_*), which the
+# server inherits.
+ROOT = os.path.dirname(os.path.abspath(__file__))
+POLL_S = 0.2  # same as step 2's wait_for_render fragment
+SETTLE_TIMEOUT_S = 60
+STEP2_SLIDERS = ("Brightness", "Contrast", "Top", "Bottom", "Left", "Right", "Min Threshold", "Max Threshold")
+
+
+# --- SERVER ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(port):
+    # XSRF protection is off so the harness can upload without a browser cookie
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", os.path.join(ROOT, "app.py"), "--server.headless=true",
+         f"--server.port={port}", "--server.address=127.0.0.1", "--server.enableXsrfProtection=false",
+         "--browser.gatherUsageStats=false"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/_stcore/health", timeout=1).ok:
+                return proc
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("Streamlit server did not start")
+
+
+class ProcessSampler:
+    # CPU seconds and RSS of the server process, read from /proc
+    def __init__(self, pid, interval=0.1):
+        self.pid, self.interval = pid, interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def read(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        return time.monotonic(), cpu, rss
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.samples.append(self.read())
+
+    def __enter__(self):
+        self.samples.append(self.read())
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.samples.append(self.read())
+
+    def summary(self):
+        (t0, cpu0, rss0), (t1, cpu1, rss1) = self.samples[0], self.samples[-1]
+        return {"cpu_s": round(cpu1 - cpu0, 2), "cpu_cores": round((cpu1 - cpu0) / max(t1 - t0, 1e-9), 2),
+                "rss_start_mb": round(rss0 / 2**20, 1), "rss_peak_mb": round(max(s[2] for s in self.samples) / 2**20, 1),
+                "rss_end_mb": round(rss1 / 2**20, 1), "rss_growth_mb": round((rss1 - rss0) / 2**20, 1)}
+
+
+# --- CLIENT SESSION ---
+class Session:
+    # One browser tab: keeps the widget values it has set and sends them with
+    # every rerun, like the frontend does
+    def __init__(self, port, ws):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        self._back, self._forward = BackMsg, ForwardMsg
+        self.port, self.ws = port, ws
+        self.session_id = None
+        self.widgets = {}   # label (or component name) -> element proto
+        self.states = {}    # widget id -> WidgetState of values this session has set
+        self.captions = []  # image captions and alerts of the last run, to tell a stale preview
+        self._cache = {}    # ForwardMsg hash -> message, for ref_hash replies
+
+    def _receive(self):
+        msg = self._forward()
+        msg.ParseFromString(self.ws.recv())
+        if msg.hash:
+            self._cache[msg.hash] = msg
+        if msg.WhichOneof("type") == "ref_hash":
+            msg = self._cache[msg.ref_hash]
+        return msg
+
+    def rerun(self, triggers=()):
+        back = self._back()
+        back.rerun_script.page_script_hash = ""
+        for state in list(self.states.values()) + list(triggers):
+            back.rerun_script.widget_states.widgets.append(state)
+        start = time.perf_counter()
+        self.ws.send(back.SerializeToString())
+        widgets, captions = {}, []
+        while True:
+            msg = self._receive()
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                # Sent at the start of every script run, including one after st.rerun()
+                self.session_id = msg.new_session.initialize.session_id or self.session_id
+                widgets, captions = {}, []
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                element = msg.delta.new_element
+                name = element.WhichOneof("type")
+                proto = getattr(element, name)
+                if name == "component_instance":
+                    widgets[proto.component_name.rsplit(".", 1)[-1]] = proto
+                elif getattr(proto, "id", "") and getattr(proto, "label", ""):
+                    widgets[proto.label] = proto
+                elif name == "imgs":
+                    captions += [img.caption for img in proto.imgs]
+                elif name == "alert":
+                    captions.append(proto.body)
+            elif kind == "script_finished":
+                if msg.script_finished == self._forward.FINISHED_EARLY_FOR_RERUN:
+                    continue  # st.rerun(): the script starts over within the same request
+                if msg.script_finished == self._forward.FINISHED_WITH_COMPILE_ERROR:
+                    raise RuntimeError("app.py failed to compile")
+                break
+        elapsed = time.perf_counter() - start
+        # Widgets that are gone (another step) drop out of the sent state
+        ids = {w.id for w in widgets.values()}
+        self.states = {k: v for k, v in self.states.items() if k in ids}
+        self.widgets, self.captions = widgets, captions
+        return elapsed
+
+    def _state(self, label):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        state = WidgetState()
+        state.id = self.widgets[label].id
+        return state
+
+    def set(self, label, field, value):
+        state = self._state(label)
+        if field == "double_array_value":
+            state.double_array_value.data.extend(value)
+        else:
+            setattr(state, field, value)
+        self.states[state.id] = state
+        return self.rerun()
+
+    def click(self, label):
+        state = self._state(label)
+        state.trigger_value = True
+        return self.rerun([state])
+
+    def upload(self, name, data):
+        # Same three steps as the browser: ask for an upload URL, PUT the file,
+        # then rerun with the uploader's state pointing at it
+        from streamlit.proto.Common_pb2 import FileUploaderState
+        back = self._back()
+        back.file_urls_request.request_id = uuid.uuid4().hex
+        back.file_urls_request.session_id = self.session_id
+        back.file_urls_request.file_names.append(name)
+        self.ws.send(back.SerializeToString())
+        while True:
+            msg = self._receive()
+            if msg.WhichOneof("type") == "file_urls_response":
+                urls = msg.file_urls_response.file_urls[0]
+                break
+        requests.put(f"http://127.0.0.1:{self.port}{urls.upload_url}",
+                     files={"file": (name, data, "image/jpeg")}, timeout=60).raise_for_status()
+        state = self._state("Reference image")
+        uploader = FileUploaderState()
+        info = uploader.uploaded_file_info.add()
+        info.file_id, info.name, info.size = urls.file_id, name, len(data)
+        info.file_urls.CopyFrom(urls)
+        state.file_uploader_state_value.CopyFrom(uploader)
+        self.states[state.id] = state
+        return self.rerun()
+
+    def stale(self):
+        return any(c.startswith("⏳") for c in self.captions)
+
+
+# --- SCENARIO ---
+def step2_action(session, rng):
+    # A random control that exists in the current step 2 layout
+    choices = ["style", "rotate"] + [s for s in STEP2_SLIDERS if s in session.widgets]
+    choice = rng.choice(choices)
+    if choice == "style":
+        options = list(session.widgets["Style"].options)
+        return "style", session.set("Style", "string_value", rng.choice(options))
+    if choice == "rotate":
+        return "rotate", session.click(rng.choice(["↺ Rotate Left", "↻ Rotate Right"]))
+    slider = session.widgets[choice]
+    steps = int(round((slider.max - slider.min) / slider.step))
+    value = slider.min + rng.randint(0, steps) * slider.step
+    return "slider", session.set(choice, "double_array_value", [value])
+
+def play(session, name, jpeg, args, rng, record):
+    record("step1", session.rerun())
+    record("upload", session.upload(name, jpeg))
+    record("start", session.click("Start Designing ➔"))
+    for _ in range(args.actions):
+        time.sleep(rng.expovariate(1000 / args.think_ms) if args.think_ms else 0)
+        kind, seconds = step2_action(session, rng)
+        record("step2", seconds)
+        record(f"step2:{kind}", seconds)
+        # Keep polling while the preview is still rendering in the background
+        settled = seconds
+        deadline = time.monotonic() + SETTLE_TIMEOUT_S
+        while session.stale() and time.monotonic() < deadline:
+            time.sleep(POLL_S)
+            settled += POLL_S + session.rerun()
+        record("step2:settled", settled)
+    if "point_preview" in session.widgets:
+        # Client-side preview: the component commits the look and enters AR
+        state = session._state("point_preview")
+        state.json_value = json.dumps({"brightness": rng.randint(-50, 50), "contrast": 1.0,
+                                       "grid": rng.random() < 0.5, "nonce": rng.random()})
+        session.states[state.id] = state
+        record("enter_ar", session.rerun())
+    else:
+        record("enter_ar", session.click("Enter AR Tracing Mode ➔"))
+    record("step3", session.rerun())
+    if "ar_tracer" in session.widgets:
+        record("step3:zoom", session.set("ar_tracer", "json_value", json.dumps({"level": 1, "tile": 0})))
+
+def run_session(index, args, port, latencies, errors, barrier):
+    rng = random.Random(f"{args.seed}-{index}")
+    ok, jpeg = cv2.imencode(".jpg", make_image(args.mp, "photo", True, seed=args.seed * 1000 + index),
+                            [cv2.IMWRITE_JPEG_QUALITY, 90])
+    record = lambda phase, seconds: latencies.setdefault(phase, []).append(seconds)
+    barrier.wait()
+    try:
+        with connect(f"ws://127.0.0.1:{port}/_stcore/stream", max_size=None, subprotocols=["streamlit"]) as ws:
+            play(Session(port, ws), f"session-{index}.jpg", jpeg.tobytes(), args, rng, record)
+    except Exception as e:
+        errors.append(f"session {index}: {type(e).__name__}: {e}")
+
+
+def percentiles(values):
+    ms = sorted(v * 1000 for v in values)
+    if len(ms) == 1:
+        return {"n": 1, "p50": round(ms[0], 1), "p95": round(ms[0], 1), "p99": round(ms[0], 1), "max": round(ms[0], 1)}
+    q = statistics.quantiles(ms, n=100, method="inclusive")
+    return {"n": len(ms), "p50": round(q[49], 1), "p95": round(q[94], 1), "p99": round(q[98], 1),
+            "max": round(ms[-1], 1)}
+
+def run_level(sessions, args):
+    port = free_port()
+    server = start_server(port)
+    latencies, errors = {}, []
+    barrier = threading.Barrier(sessions + 1)
+    threads = [threading.Thread(target=run_session, args=(i, args, port, latencies, errors, barrier))
+               for i in range(sessions)]
+    try:
+        with ProcessSampler(server.pid) as sampler:
+            for t in threads:
+                t.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for t in threads:
+                t.join()
+            wall = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    reruns = sum(len(v) for k, v in latencies.items() if ":" not in k)
+    return {"sessions": sessions, "wall_s": round(wall, 2), "reruns": reruns,
+            "reruns_per_s": round(reruns / wall, 2), "sessions_per_min": round(sessions * 60 / wall, 2),
+            "latency_ms": {phase: percentiles(v) for phase, v in sorted(latencies.items())},
+            "server": sampler.summary(), "errors": errors}
+
+
+def print_level(result):
+    s = result["server"]
+    print(f"\n{result['sessions']} session(s): {result['reruns']} reruns in {result['wall_s']} s "
+          f"({result['reruns_per_s']} reruns/s), server CPU {s['cpu_cores']} cores, "
+          f"RSS {s['rss_start_mb']:.0f} -> {s['rss_end_mb']:.0f} MB (peak {s['rss_peak_mb']:.0f})")
+    print(f"  {'phase':<16} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for phase, p in result["latency_ms"].items():
+        print(f"  {phase:<16} {p['n']:>5} {p['p50']:>9.1f} {p['p95']:>9.1f} {p['p99']:>9.1f} {p['max']:>9.1f}")
+    for error in result["errors"]:
+        print(f"  ERROR {error}", file=sys.stderr)
+
+
+def capacity(levels, threshold):
+    # Most sessions whose step-2 p95 stays within `threshold` of the lowest level's
+    base = levels[0]["latency_ms"].get("step2", {}).get("p95")
+    best = None
+    for level in levels:
+        p95 = level["latency_ms"].get("step2", {}).get("p95")
+        if base is None or p95 is None or level["errors"] or p95 > base * (1 + threshold):
+            break
+        best = level["sessions"]
+    return best
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test one Glass Canvas replica with concurrent sessions.")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8], help="concurrency levels to run")
+    parser.add_argument("--actions", type=int, default=20, help="step 2 control changes per session")
+    parser.add_argument("--mp", type=float, default=4, help="megapixels of each session's upload")
+    parser.add_argument("--think-ms", type=float, default=0,
+                        help="mean pause between actions (exponential); 0 = back to back")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="step 2 p95 slowdown that counts as degraded (0.5 = 50%%)")
+    parser.add_argument("-o", "--output", default="load_results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    levels = []
+    for sessions in args.sessions:
+        result = run_level(sessions, args)
+        print_level(result)
+        levels.append(result)
+    report = {
+        "meta": {"python": platform.python_version(), "cpus": os.cpu_count(), "seed": args.seed,
+                 "actions": args.actions, "mp": args.mp, "think_ms": args.think_ms,
+                 "env": {k: v for k, v in os.environ.items() if k.startswith("GLASS_CANVAS_")}},
+        "levels": levels,
+        "max_sessions": capacity(levels, args.threshold),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nStep 2 p95 stays within {args.threshold:.0%} of the baseline up to "
+          f"{report['max_sessions']} session(s). Wrote {args.output}")
+    return 1 if any(level["errors"] for level in levels) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+
+# --- RENDER METRICS ---
+# Every pipeline stage reports wall time, bytes produced and output shape.
+# Records are kept per rerun (for the debug panel) and aggregated per process
+# into latency histograms that can be exported as JSON or Prometheus text.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_FILE = os.environ.get("GLASS_CANVAS_METRICS_FILE")  # e.g. a node_exporter textfile path
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.bytes = 0
+
+    def observe(self, seconds, nbytes=0):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.bytes += nbytes
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count: return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+_lock = threading.Lock()
+_histograms = {}  # (stage, style) -> Histogram
+_run = contextvars.ContextVar("glass_canvas_run", default=None)
+
+
+def start_run():
+    # Streamlit runs each session's script in its own thread, so a context
+    # variable keeps concurrent sessions' records apart
+    records = []
+    _run.set(records)
+    return records
+
+def current_run():
+    return _run.get() or []
+
+def record(stage, seconds, style="", nbytes=0, shape=None, cached=False):
+    records = _run.get()
+    if records is not None:
+        records.append({
+            "stage": stage, "style": style, "ms": round(seconds * 1000, 2),
+            "bytes": nbytes, "shape": list(shape) if shape is not None else None, "cached": cached,
+        })
+    if cached:
+        return
+    with _lock:
+        hist = _histograms.get((stage, style))
+        if hist is None:
+            hist = _histograms[(stage, style)] = Histogram()
+        hist.observe(seconds, nbytes)
+
+
+class timed:
+    # with metrics.timed("render", style=mode) as m: ...; m.result = image
+    def __init__(self, stage, style=""):
+        self.stage = stage
+        self.style = style
+        self.result = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            nbytes = getattr(self.result, "nbytes", None)
+            if nbytes is None and self.result is not None: nbytes = len(self.result)
+            record(self.stage, time.perf_counter() - self.start, self.style,
+                   nbytes or 0, getattr(self.result, "shape", None))
+
+
+def snapshot():
+    with _lock:
+        return {key: (list(h.counts), h.sum, h.count, h.bytes) for key, h in _histograms.items()}
+
+def to_json():
+    out = []
+    for (stage, style), (counts, total, count, nbytes) in sorted(snapshot().items()):
+        hist = Histogram()
+        hist.counts, hist.sum, hist.count, hist.bytes = counts, total, count, nbytes
+        out.append({
+            "stage": stage, "style": style, "count": count, "sum_seconds": round(total, 6), "bytes": nbytes,
+            "p50_seconds": hist.quantile(0.5), "p95_seconds": hist.quantile(0.95),
+            "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], counts)),
+        })
+    return json.dumps({"pid": os.getpid(), "histograms": out}, indent=2)
+
+def to_prometheus():
+    lines = [
+        "# HELP glass_canvas_stage_seconds Wall time of Glass Canvas processing stages.",
+        "# TYPE glass_canvas_stage_seconds histogram",
+    ]
+    byte_lines = [
+        "# HELP glass_canvas_stage_bytes_total Bytes produced by Glass Canvas processing stages.",
+        "# TYPE glass_canvas_stage_bytes_total counter",
+    ]
+    for (stage, style), (counts, total, count, nbytes) in sorted(snapshot().items()):
+        labels = f'stage="{stage}",style="{style}"'
+        cumulative = 0
+        for bound, n in zip([str(b) for b in BUCKETS] + ["+Inf"], counts):
+            cumulative += n
+            lines.append(f'glass_canvas_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"glass_canvas_stage_seconds_sum{{{labels}}} {total}")
+        lines.append(f"glass_canvas_stage_seconds_count{{{labels}}} {count}")
+        byte_lines.append(f"glass_canvas_stage_bytes_total{{{labels}}} {nbytes}")
+    return "\n".join(lines + byte_lines) + "\n"
+
+_export_lock = threading.Lock()  # not _lock: snapshot() takes that one
+export_failures = 0
+
+def write_textfile(path=None):
+    # Runs at the end of every session's rerun. One writer per process at a
+    # time, a temp file per write, and a failed export never reaches the page.
+    global export_failures
+    path = path or METRICS_FILE
+    if not path: return
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with _export_lock:
+        try:
+            with open(tmp, "w") as f:
+                f.write(to_prometheus())
+            os.replace(tmp, path)
+        except OSError:
+            export_failures += 1
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
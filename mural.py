@@ -0,0 +1,96 @@
+import os
+import zipfile
+
+import cv2
+
+import metrics
+from overlay import STATIC_DIR, write_static
+from processing import grid_lines, register_source, run_stage, source_key, stage_key
+from shared_cache import flight
+
+# --- MURAL TILING ---
+# Large murals are traced one section at a time. The image is cut along the
+# same lines draw_grid uses, each tile is grown by MURAL_OVERLAP of a tile on
+# every inner side, and the cut points carry registration marks so that
+# neighbouring tiles line up on the wall. Tiles are rendered only when the
+# AR view pages to them. The archive is written to disk one tile at a time.
+MURAL_OVERLAP = float(os.environ.get("GLASS_CANVAS_MURAL_OVERLAP", "0.08"))
+MURAL_MAX = 8  # tiles per side (row names run A..H)
+
+
+def tile_edges(h, w, cols, rows):
+    xs = [0] + grid_lines(h, w, cols)[0] + [w]
+    ys = [0] + grid_lines(h, w, rows)[1] + [h]
+    return xs, ys
+
+def tile_box(h, w, cols, rows, index, overlap=MURAL_OVERLAP):
+    xs, ys = tile_edges(h, w, cols, rows)
+    r, c = divmod(index, cols)
+    ox, oy = round(w / cols * overlap), round(h / rows * overlap)
+    return max(0, xs[c] - ox), max(0, ys[r] - oy), min(w, xs[c + 1] + ox), min(h, ys[r + 1] + oy)
+
+def tile_name(cols, index):
+    r, c = divmod(index, cols)
+    return f"{chr(ord('A') + r)}{c + 1}"
+
+def mark_color(image):
+    # Magenta on colour; on monochrome whichever of black/white stands out
+    # (keeps bilevel styles bilevel, so they still encode as 1-bit PNG)
+    if image.ndim > 2: return (255, 0, 255)
+    return 0 if image.mean() > 127 else 255
+
+def render_tile(image, cols, rows, index, overlap=MURAL_OVERLAP):
+    h, w = image.shape[:2]
+    x0, y0, x1, y1 = tile_box(h, w, cols, rows, index, overlap)
+    tile = image[y0:y1, x0:x1].copy()
+    xs, ys = tile_edges(h, w, cols, rows)
+    r, c = divmod(index, cols)
+    color = mark_color(image)
+    size = max(8, min(h // rows, w // cols) // 40)  # same on every tile, so shared marks match
+
+    # Registration marks where this tile's cut lines cross, on every cut that
+    # is shared with a neighbour; the same marks land in the neighbour's overlap
+    for x in (xs[c], xs[c + 1]):
+        for y in (ys[r], ys[r + 1]):
+            if x in (0, w) and y in (0, h): continue
+            px, py = x - x0, y - y0
+            cv2.line(tile, (px - 2 * size, py), (px + 2 * size, py), color, 2)
+            cv2.line(tile, (px, py - 2 * size), (px, py + 2 * size), color, 2)
+            cv2.circle(tile, (px, py), size, color, 2)
+
+    # Name label inside the tile's own part, clear of the overlap bands
+    scale = size / 12
+    ox, oy = round(w / cols * overlap), round(h / rows * overlap)
+    cv2.putText(tile, tile_name(cols, index), (xs[c] + ox - x0 + size, ys[r] + oy - y0 + 3 * size),
+                cv2.FONT_HERSHEY_SIMPLEX, scale, color, max(1, round(scale * 2)))
+    return tile
+
+def get_tile(image, cols, rows, index, overlap=MURAL_OVERLAP):
+    key, tile = run_stage(source_key(image), "mural", (cols, rows, round(overlap, 4), index),
+                          lambda img: render_tile(img, cols, rows, index, overlap), image)
+    register_source(tile, key)  # the overlay pyramid caches on the tile without rehashing it
+    return tile
+
+def export_zip(image, cols, rows, overlap=MURAL_OVERLAP, png_level=6):
+    # Served by Streamlit's static file serving, which streams it from disk.
+    # Tiles bypass the stage cache so an export doesn't evict the live tiles.
+    # Sessions exporting the same art at once share one build.
+    name = f"{stage_key(source_key(image), 'mural-zip', cols, rows, round(overlap, 4), png_level)}.zip"
+    path = os.path.join(STATIC_DIR, name)
+
+    def write(tmp):
+        with metrics.timed("mural-zip"), zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED) as zf:
+            for index in range(cols * rows):
+                tile = render_tile(image, cols, rows, index, overlap)
+                ok, buf = cv2.imencode(".png", tile, [cv2.IMWRITE_PNG_COMPRESSION, png_level])
+                if not ok:
+                    raise ValueError("Could not encode mural tile")
+                zf.writestr(f"tile_{tile_name(cols, index)}.png", buf.tobytes())  # PNG is already compressed
+
+    def build():
+        if not os.path.exists(path):  # written by the flight we queued behind
+            write_static(path, write)
+
+    if not os.path.exists(path):
+        flight.do(name, build)
+    return f"app/static/overlays/{name}"
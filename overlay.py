@@ -0,0 +1,150 @@
+import base64
+import os
+import uuid
+
+import cv2
+
+import metrics
+from processing import StageCache, bit_depth, resize_image, source_key, stage_key
+from shared_cache import disk_cache, flight
+
+# --- OVERLAY ENCODING ---
+# Step 3 re-runs on every interaction, so encoded overlays are cached by
+# (image content, format, quality/level, target size). Black-and-white images
+# are written as 1-bit PNG; everything else, greyscale included, as WebP
+# (single-channel WebP is the same size as its 3-channel twin, and a third of
+# lossless greyscale PNG for Pencil Sketch).
+ENCODE_BUDGET_BYTES = int(os.environ.get("GLASS_CANVAS_ENCODE_CACHE_MB", "64")) * 1024 * 1024
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "overlays")
+STATIC_BUDGET_BYTES = int(os.environ.get("GLASS_CANVAS_STATIC_MB", "512")) * 1024 * 1024
+
+MIME_TYPES = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+encode_cache = StageCache(ENCODE_BUDGET_BYTES)
+
+
+def is_bilevel(image):
+    return image.ndim == 2 and bit_depth(image) == 1
+
+def resolve_format(image, fmt):
+    if fmt != "auto": return fmt
+    return "png" if is_bilevel(image) else "webp"
+
+def encode_overlay(image, fmt="auto", quality=90, png_level=6, max_side=None):
+    fmt = resolve_format(image, fmt)
+    key = stage_key(source_key(image), "encode", fmt, quality, png_level, max_side)
+    data = encode_cache.get(key)
+    if data is None and disk_cache is not None:
+        data = disk_cache.get_bytes(key)
+        if data is not None:
+            encode_cache.put(key, data)
+    if data is None:
+        data, _ = flight.do(key, lambda: _encode(image, key, fmt, quality, png_level, max_side))
+    return data, MIME_TYPES[fmt]
+
+def _encode(image, key, fmt, quality, png_level, max_side):
+    data = encode_cache.peek(key)  # finished while we were queuing for the flight
+    if data is not None:
+        return data
+    if max_side and max(image.shape[:2]) > max_side:
+        image = resize_image(image, max_side / max(image.shape[:2]))
+    if fmt == "png":
+        params = [cv2.IMWRITE_PNG_COMPRESSION, png_level]
+        if is_bilevel(image):
+            params += [cv2.IMWRITE_PNG_BILEVEL, 1]
+    elif fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    else:
+        raise ValueError(f"Unsupported overlay format: {fmt}")
+    with metrics.timed(f"encode:{fmt}") as m:
+        ok, buf = cv2.imencode(f".{fmt}", image, params)  # imencode takes BGR directly
+        if not ok:
+            raise ValueError(f"Could not encode overlay as {fmt}")
+        data = m.result = buf.tobytes()
+    encode_cache.put(key, data)
+    if disk_cache is not None:
+        disk_cache.put_bytes(key, data)
+    return data
+
+def get_image_base64(image_array, **options):
+    # The data URI itself is cached too: step 3 gets the same string object
+    # back on every rerun, so the templated AR page is a cheap lookup
+    key = stage_key(source_key(image_array), "uri", sorted(options.items()))
+    uri = encode_cache.get(key)
+    if uri is None:
+        data, mime = encode_overlay(image_array, **options)
+        with metrics.timed("base64") as m:
+            uri = m.result = f"data:{mime};base64,{base64.b64encode(data).decode()}"
+        encode_cache.put(key, uri)
+    return uri
+
+def get_image_url(image_array, **options):
+    # Served by Streamlit's static file serving (server.enableStaticServing),
+    # so the component HTML stays small and the browser can cache the image
+    data, mime = encode_overlay(image_array, **options)
+    ext = mime.split("/")[1]
+    name = f"{stage_key(source_key(image_array), 'file', sorted(options.items()))}.{ext}"
+    path = os.path.join(STATIC_DIR, name)
+    if not os.path.exists(path):
+        def write(tmp):
+            with open(tmp, "wb") as f:
+                f.write(data)
+        write_static(path, write)
+    return f"app/static/overlays/{name}"
+
+def write_static(path, write):
+    # Sessions share the directory: each writer gets its own temp file, and
+    # the rename makes whichever finishes last win with identical content
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+    prune_static_dir()
+
+def prune_static_dir():
+    entries = []
+    for entry in os.scandir(STATIC_DIR):
+        if entry.name.endswith(".tmp"):
+            continue  # still being written
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue  # pruned by another session
+        entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= STATIC_BUDGET_BYTES: break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+# --- OVERLAY PYRAMID ---
+# The AR view seldom shows the overlay at full resolution (a phone is ~1080 px
+# across), so it starts from a small level and each sharper one is encoded
+# only when the page asks for it. Levels double from PYRAMID_BASE_SIDE (long
+# side) up to the full image.
+PYRAMID_BASE_SIDE = int(os.environ.get("GLASS_CANVAS_PYRAMID_BASE", "1024"))
+
+def pyramid_sides(shape):
+    full = max(shape[:2])
+    sides = []
+    side = PYRAMID_BASE_SIDE
+    while side < full:
+        sides.append(side)
+        side *= 2
+    return sides + [full]
+
+def get_overlay_level(image_array, level, as_url=False, **options):
+    sides = pyramid_sides(image_array.shape)
+    side = sides[max(0, min(level, len(sides) - 1))]
+    get = get_image_url if as_url else get_image_base64
+    return get(image_array, max_side=side, **options)
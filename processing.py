@@ -0,0 +1,648 @@
+import contextvars
+import hashlib
+import math
+import mmap
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+import metrics
+from shared_cache import disk_cache, flight
+from tiling import get_pool, run_tiled
+
+# --- 1. STAGE CACHE ---
+# Streamlit re-executes app.py on every interaction, but imported modules stay
+# loaded, so this cache lives for the whole server process.
+CACHE_BUDGET_BYTES = int(os.environ.get("GLASS_CANVAS_CACHE_MB", "256")) * 1024 * 1024
+
+
+class StageCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key):
+        # Lookup that doesn't count towards hit/miss stats
+        with self._lock:
+            return self._entries.get(key)
+
+    @staticmethod
+    def sizeof(value):
+        return value.nbytes if isinstance(value, np.ndarray) else len(value)
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)  # cached arrays are shared between reruns
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self.sizeof(self._entries.pop(key))
+            self._entries[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.bytes -= self.sizeof(old)
+                self.evictions += 1
+
+    def discard_value(self, value):
+        # Drop every entry holding this exact object (the session store hands
+        # back arrays it spills or releases, so the cache doesn't keep them resident)
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if v is value]:
+                self.bytes -= self.sizeof(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+stage_cache = StageCache(CACHE_BUDGET_BYTES)
+_source_keys = {}  # id(image) -> content key, dropped when the image is freed
+_bit_depths = {}   # id(image) -> 1 or 8 bits per sample, likewise
+
+
+def stage_key(parent_key, stage, *params):
+    return hashlib.blake2b(f"{parent_key}|{stage}|{params!r}".encode(), digest_size=16).hexdigest()
+
+
+def source_key(image):
+    # Hash the pixels once per image object; the same object is reused across reruns
+    key = _source_keys.get(id(image))
+    if key is None:
+        if isinstance(image, np.ndarray):
+            digest = hashlib.blake2b(np.ascontiguousarray(image).data, digest_size=16)
+            digest.update(f"{image.dtype}|{image.shape}".encode())
+        else:
+            digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+            digest.update(f"{image.mode}|{image.size}".encode())
+        key = digest.hexdigest()
+        register_source(image, key)
+    return key
+
+
+def register_source(image, key):
+    if id(image) not in _source_keys:
+        weakref.finalize(image, _source_keys.pop, id(image), None)
+    _source_keys[id(image)] = key
+
+
+# Black-and-white images (Magic Outline) are stored and encoded at 1 bit per
+# pixel. The pipeline registers the depth it knows; anything else is scanned
+# once per image object.
+def bit_depth(image):
+    bits = _bit_depths.get(id(image))
+    if bits is None:
+        bits = 8
+        if image.ndim == 2 and cv2.calcHist([image], [0], None, [256], [0, 256])[1:255].sum() == 0:
+            bits = 1
+        register_bit_depth(image, bits)
+    return bits
+
+
+def register_bit_depth(image, bits):
+    if id(image) not in _bit_depths:
+        weakref.finalize(image, _bit_depths.pop, id(image), None)
+    _bit_depths[id(image)] = bits
+
+
+def file_backed(image):
+    # A read-only map of a whole .npy file (spooled uploads, streamed renders,
+    # spilled session images): its pages can be dropped and re-read at will
+    return isinstance(image, np.memmap) and isinstance(image.base, mmap.mmap)
+
+
+def run_stage(parent_key, stage, params, fn, image, style=""):
+    key = stage_key(parent_key, stage, *params)
+    cached = stage_cache.get(key)
+    if cached is not None:
+        metrics.record(stage, 0.0, style, shape=cached.shape, cached=True)
+        return key, cached
+
+    def compute():
+        cached = stage_cache.peek(key)  # finished while we were queuing for the flight
+        if cached is not None:
+            return cached
+        start = time.perf_counter()
+        result = fn(image)
+        new_bytes = 0
+        if result is not image:  # pass-through stages would double count bytes
+            stage_cache.put(key, result)
+            new_bytes = result.nbytes
+        metrics.record(stage, time.perf_counter() - start, style, new_bytes, result.shape)
+        return result
+
+    # Sessions asking for the same stage at once share one computation
+    result, leader = flight.do(key, compute)
+    if not leader:
+        metrics.record(stage, 0.0, style, shape=result.shape, cached=True)
+    return key, result
+
+
+# --- 2. IMAGE OPERATIONS ---
+STYLES = ["Original", "Grayscale", "Magic Outline", "Pencil Sketch", "Crayon Drawing", "Abstract", "Sepia", "Negative"]
+
+def rotate_image(image, k):
+    if k % 4 == 0: return image
+    return np.rot90(image, k=k)
+
+def crop_image(image, left_p, right_p, top_p, bottom_p):
+    h, w = image.shape[:2]
+    x_start = int(w * (left_p / 100))
+    x_end = int(w * (1 - right_p / 100))
+    y_start = int(h * (top_p / 100))
+    y_end = int(h * (1 - bottom_p / 100))
+    if x_start >= x_end or y_start >= y_end: return image
+    return image[y_start:y_end, x_start:x_end]
+
+def adjust_brightness_contrast(image, alpha, beta):
+    if alpha == 1 and beta == 0: return image
+    return cv2.convertScaleAbs(image, alpha=alpha, beta=beta)
+
+# Point operations (brightness/contrast, Grayscale, Negative, Sepia) are fused
+# so each mode makes one full-frame pass and allocates one output. When the
+# brightness/contrast map is affine over 0..255 (no clipping, no abs), it is
+# folded into the colour mix: a 3x4 cv2.transform for Sepia, or a cheap
+# single-channel pass after the grey conversion. Otherwise the second step
+# runs in place in the first step's buffer.
+POINT_MODES = ("Original", "Grayscale", "Negative", "Sepia")
+SEPIA_KERNEL = np.array([[0.272, 0.534, 0.131], [0.349, 0.686, 0.168], [0.393, 0.769, 0.189]])
+
+def is_affine(alpha, beta):
+    return beta >= 0 and alpha * 255 + beta <= 255
+
+def apply_point_ops(img_cv, mode, alpha, beta):
+    if mode == "Original":
+        return adjust_brightness_contrast(img_cv, alpha, beta)
+    if mode == "Negative":
+        buf = cv2.convertScaleAbs(img_cv, alpha=alpha, beta=beta)
+        return cv2.bitwise_not(buf, dst=buf)
+    if mode == "Grayscale":
+        if is_affine(alpha, beta):
+            gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
+            return cv2.convertScaleAbs(gray, dst=gray, alpha=alpha, beta=beta)
+        return cv2.cvtColor(cv2.convertScaleAbs(img_cv, alpha=alpha, beta=beta), cv2.COLOR_BGR2GRAY)
+    # Sepia
+    if is_affine(alpha, beta):
+        matrix = np.hstack([SEPIA_KERNEL * alpha, SEPIA_KERNEL.sum(axis=1, keepdims=True) * beta])
+        return cv2.transform(img_cv, matrix)
+    buf = cv2.convertScaleAbs(img_cv, alpha=alpha, beta=beta)
+    return cv2.transform(buf, SEPIA_KERNEL, dst=buf)
+
+# Output channels and bits per sample of each style. Monochrome styles stay
+# single channel from the filter through grid, session storage and encoding;
+# Magic Outline is pure black and white until grid lines (grey) are drawn.
+MONO_STYLES = ("Grayscale", "Magic Outline", "Pencil Sketch")
+
+def output_format(mode, show_grid=False):
+    channels = 1 if mode in MONO_STYLES else 3
+    bits = 1 if mode == "Magic Outline" and not show_grid else 8
+    return channels, bits
+
+def scaled_kernel(size, scale, minimum=1):
+    # Keep neighbourhood sizes proportional on proxies; odd for OpenCV kernels
+    k = max(minimum, int(round(size * scale)))
+    return k if k % 2 else k + 1
+
+def proxy_scale(shape, rotation, preview_width):
+    if not preview_width: return 1.0
+    h, w = shape[:2]
+    width = w if rotation % 2 == 0 else h
+    return min(1.0, preview_width / width)
+
+def resize_image(image, scale):
+    if scale >= 1.0: return image
+    h, w = image.shape[:2]
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+def grid_lines(h, w, grid_size=3):
+    # Column and row positions of the grid lines (also drawn strip by strip in streaming)
+    xs = [int(w * i / grid_size) for i in range(1, grid_size)]
+    ys = [int(h * i / grid_size) for i in range(1, grid_size)]
+    return xs, ys
+
+def draw_grid(image, grid_size=3):
+    h, w = image.shape[:2]
+    color = (100, 255, 100) if len(image.shape) > 2 else 180
+    
+    # Create a copy to draw lines on
+    img_grid = image.copy()
+    
+    xs, ys = grid_lines(h, w, grid_size)
+    for x in xs:
+        cv2.line(img_grid, (x, 0), (x, h), color, 1)
+    for y in ys:
+        cv2.line(img_grid, (0, y), (w, y), color, 1)
+    return img_grid
+
+# Heavy filters run through tiling.run_tiled. Crayon tiles are bit-exact with
+# the monolithic filter. Mean shift works on a 2-level pyramid and its paths
+# drift, so Abstract is never exact: it needs tile offsets on a multiple of 4
+# (see style_align) and a halo of 8 spatial windows. On the benchmark's photo
+# images (1.5-6 MP, 6 seeds) at most 0.009% of pixels then differ from the
+# monolithic output, by at most 4 levels (with 4 windows: up to 0.04%, 30 levels).
+# benchmark.py fails if a run exceeds ABSTRACT_TILE_TOLERANCE.
+ABSTRACT_HALO_WINDOWS = 8
+ABSTRACT_TILE_TOLERANCE = (0.01, 16)  # % of pixels that may differ, max difference in levels
+
+def crayon_filter(img_cv, scale=1.0):
+    final_img = cv2.bilateralFilter(img_cv, scaled_kernel(9, scale), 75, 75 * scale)
+    gray = cv2.cvtColor(final_img, cv2.COLOR_BGR2GRAY)
+    block = scaled_kernel(9, scale, minimum=3)
+    edges = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block, 9)
+    return cv2.bitwise_and(final_img, final_img, mask=edges)
+
+def abstract_filter(img_cv, scale=1.0):
+    return cv2.pyrMeanShiftFiltering(img_cv, max(1.0, 21 * scale), 51)
+
+# Abstract engine tiers. "quality" is the full-resolution mean shift above.
+# "balanced" runs it at half resolution and puts the edges back with a fast
+# guided upsampling step (He & Sun 2015, guided by luma); "fast" smooths with
+# a bilateral filter and posterizes to a k-means palette. Measured against
+# "quality" with `python benchmark.py --styles Abstract --kinds photo` (1 core,
+# 2 MP / 12 MP):
+#   balanced   8.4x / 6.1x faster   SSIM 0.993 / 0.998   PSNR 38 / 43 dB
+#   fast      12.4x / 6.5x faster   SSIM 0.92 / 0.95     PSNR 21 dB
+# The fast tier's palette shifts flat colours a little (hence the PSNR); on
+# pure noise it diverges completely (SSIM 0.05), which photos never hit.
+ABSTRACT_TIERS = ("fast", "balanced", "quality")
+ABSTRACT_TIER = os.environ.get("GLASS_CANVAS_ABSTRACT_TIER", "quality")
+ABSTRACT_COLORS = 16
+PALETTE_SAMPLES = 20000
+PALETTE_PIXELS = 1_000_000
+
+def guided_upsample(guide, low, radius=1, eps=1e-3):
+    # Fit low ~ a * luma + b in small windows at low resolution, then apply the
+    # upsampled (a, b) to the full-resolution luma
+    h, w = guide.shape[:2]
+    small = cv2.resize(guide, (low.shape[1], low.shape[0]), interpolation=cv2.INTER_AREA)
+    size = (2 * radius + 1, 2 * radius + 1)
+    lum = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255
+    p = low.astype(np.float32) / 255
+    mean_i = cv2.boxFilter(lum, -1, size)[..., None]
+    var_i = cv2.boxFilter(lum * lum, -1, size)[..., None] - mean_i * mean_i
+    lum = lum[..., None]
+    mean_p = cv2.boxFilter(p, -1, size)
+    a = (cv2.boxFilter(p * lum, -1, size) - mean_p * mean_i) / (var_i + eps)
+    b = mean_p - a * mean_i
+    b *= 255
+    a = cv2.resize(cv2.boxFilter(a, -1, size), (w, h), interpolation=cv2.INTER_LINEAR)
+    b = cv2.resize(cv2.boxFilter(b, -1, size), (w, h), interpolation=cv2.INTER_LINEAR)
+    # In place: three full-resolution float planes is the peak
+    a *= cv2.cvtColor(guide, cv2.COLOR_BGR2GRAY).astype(np.float32)[..., None]
+    a += b
+    return cv2.convertScaleAbs(a)
+
+def abstract_balanced(img_cv, scale=1.0):
+    # Pad to even sizes so the 2x down/up scaling stays exact (and tiles line up)
+    h, w = img_cv.shape[:2]
+    padded = cv2.copyMakeBorder(img_cv, 0, h % 2, 0, w % 2, cv2.BORDER_REPLICATE)
+    small = cv2.resize(padded, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+    return guided_upsample(padded, abstract_filter(small, scale / 2))[:h, :w]
+
+def smooth_for_palette(img_cv, scale=1.0):
+    return cv2.bilateralFilter(img_cv, scaled_kernel(9, scale), 50, 7 * max(scale, 0.5))
+
+def palette_step(h, w):
+    # The palette is fitted on every n-th pixel (at most PALETTE_PIXELS), which a
+    # strip-by-strip render (streaming) can pick out exactly
+    return max(1, math.ceil((h * w / PALETTE_PIXELS) ** 0.5))
+
+def abstract_palette(img_cv, colors=ABSTRACT_COLORS, seed=0):
+    # k-means on a fixed-seed subsample, so the same image always gets the same palette
+    pixels = img_cv.reshape(-1, 3)
+    rng = np.random.default_rng(seed)
+    sample = pixels[rng.integers(0, len(pixels), min(PALETTE_SAMPLES, len(pixels)))].astype(np.float32)
+    cv2.setRNGSeed(seed)
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+    _, _, centers = cv2.kmeans(sample, min(colors, len(sample)), None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+    return centers
+
+def quantize(img_cv, palette):
+    # Nearest palette colour for each cell of a 32x32x32 colour grid, then one
+    # table lookup per pixel instead of a distance per pixel and colour
+    grid = np.arange(32, dtype=np.float32) * 8 + 4
+    cells = np.stack(np.meshgrid(grid, grid, grid, indexing="ij"), -1).reshape(-1, 3)
+    dist = (palette ** 2).sum(1) - 2 * cells @ palette.T
+    lut = np.round(palette).astype(np.uint8)[dist.argmin(1)]
+    q = (img_cv >> 3).astype(np.int32)
+    return lut[(q[..., 0] << 10) | (q[..., 1] << 5) | q[..., 2]]
+
+def abstract_fast(img_cv, scale=1.0, palette=None):
+    if palette is None:
+        step = palette_step(*img_cv.shape[:2])
+        palette = abstract_palette(smooth_for_palette(np.ascontiguousarray(img_cv[::step, ::step]), scale / step))
+    return quantize(smooth_for_palette(img_cv, scale), palette)
+
+def outline_gradients(img_cv, scale=1.0):
+    # Blur + Sobel, the part of Canny that doesn't depend on the thresholds;
+    # dx and dy are stacked so the pair caches as one array. Takes BGR or an
+    # already converted grey image (the contact sheet shares one).
+    gray = img_cv if img_cv.ndim == 2 else cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
+    k = scaled_kernel(5, scale)
+    blurred = cv2.GaussianBlur(gray, (k, k), 0)
+    grad = np.empty((2,) + blurred.shape, np.int16)
+    # Same aperture and border as Canny's own Sobel, so the edges are identical
+    cv2.Sobel(blurred, cv2.CV_16S, 1, 0, dst=grad[0], ksize=3, borderType=cv2.BORDER_REPLICATE)
+    cv2.Sobel(blurred, cv2.CV_16S, 0, 1, dst=grad[1], ksize=3, borderType=cv2.BORDER_REPLICATE)
+    return grad
+
+def outline_edges(grad, t1, t2):
+    # Non-maximum suppression + hysteresis only
+    edges = cv2.Canny(grad[0], grad[1], t1, t2)
+    return cv2.bitwise_not(edges, dst=edges)
+
+def pencil_sketch(img_cv, scale=1.0):
+    gray = img_cv if img_cv.ndim == 2 else cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
+    inv = cv2.bitwise_not(gray)
+    k = scaled_kernel(21, scale)
+    blur = cv2.GaussianBlur(inv, (k, k), 0)
+    return cv2.divide(gray, 255 - blur, scale=256)
+
+def style_halo(mode, scale=1.0, tier="quality"):
+    # Rows/columns of real neighbourhood a tile or strip needs for a seamless result
+    if mode == "Magic Outline":
+        # blur radius + Sobel; Canny's hysteresis can still reach further along an edge
+        return scaled_kernel(5, scale) // 2 + 8
+    if mode == "Pencil Sketch":
+        return scaled_kernel(21, scale) // 2
+    if mode == "Crayon Drawing":
+        # bilateral radius + adaptive threshold radius
+        return 2 * (scaled_kernel(9, scale, minimum=3) // 2)
+    if mode == "Abstract":
+        if tier == "fast":
+            return scaled_kernel(9, scale) // 2
+        return int(ABSTRACT_HALO_WINDOWS * max(1.0, 21 * scale))
+    return 0
+
+def style_align(mode, tier="quality"):
+    # Tile/strip offsets must be multiples of this for pyramid-based filters:
+    # mean shift's pyramid needs 4, and "balanced" runs it at half resolution
+    if mode != "Abstract" or tier == "fast": return 2
+    return 8 if tier == "balanced" else 4
+
+def apply_style(img_cv, mode, t1, t2, scale=1.0, tier="quality"):
+    final_img = img_cv
+    if mode == "Grayscale":
+        final_img = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
+    elif mode == "Magic Outline":
+        final_img = outline_edges(outline_gradients(img_cv, scale), t1, t2)
+    elif mode == "Pencil Sketch":
+        final_img = pencil_sketch(img_cv, scale)
+    elif mode == "Crayon Drawing":
+        final_img = run_tiled(lambda tile: crayon_filter(tile, scale), img_cv, style_halo(mode, scale))
+    elif mode == "Abstract" and tier == "fast":
+        # The palette is global, so this tier isn't tiled (bilateralFilter is threaded by OpenCV)
+        final_img = abstract_fast(img_cv, scale)
+    elif mode == "Abstract":
+        fn = abstract_balanced if tier == "balanced" else abstract_filter
+        final_img = run_tiled(lambda tile: fn(tile, scale), img_cv, style_halo(mode, scale, tier),
+                              align=style_align(mode, tier))
+    elif mode == "Negative":
+        final_img = cv2.bitwise_not(img_cv)
+    elif mode == "Sepia":
+        final_img = cv2.transform(img_cv, SEPIA_KERNEL)
+    return final_img
+
+
+# --- 3. INGESTION ---
+# Uploads are decoded once, straight to BGR, and stored under the hash of the
+# uploaded bytes, so reruns and re-uploads of the same file skip decoding.
+MAX_INPUT_PIXELS = int(float(os.environ.get("GLASS_CANVAS_MAX_MP", "250")) * 1_000_000)
+WORKING_PIXELS = int(float(os.environ.get("GLASS_CANVAS_WORKING_MP", "12")) * 1_000_000)
+Image.MAX_IMAGE_PIXELS = MAX_INPUT_PIXELS  # keep PIL's own bomb check in line with ours
+
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def jpeg_reduction(w, h):
+    # Largest DCT downscale that still leaves at least the working resolution
+    factor = 1
+    while factor < 8 and (w // (factor * 2)) * (h // (factor * 2)) >= WORKING_PIXELS:
+        factor *= 2
+    return factor
+
+def read_header(source):
+    # Size and format from the header only, checked against the pixel limit.
+    # PIL raises its own bomb error above 2x MAX_IMAGE_PIXELS before we get to look.
+    try:
+        with Image.open(source) as im:
+            w, h = im.size
+            fmt = im.format
+    except Image.DecompressionBombError:
+        raise ImageTooLargeError(
+            f"Image is over twice the {MAX_INPUT_PIXELS / 1e6:.0f} MP limit.") from None
+    except UnidentifiedImageError:
+        raise ValueError("This file isn't an image we can read.") from None
+    if w * h > MAX_INPUT_PIXELS:
+        raise ImageTooLargeError(
+            f"Image is {w * h / 1e6:.0f} MP; the limit is {MAX_INPUT_PIXELS / 1e6:.0f} MP.")
+    return w, h, fmt
+
+def decode_image(data):
+    w, h, fmt = read_header(BytesIO(data))
+
+    factor = jpeg_reduction(w, h) if fmt == "JPEG" else 1
+    # imdecode applies EXIF orientation and returns BGR uint8 directly
+    img_cv = cv2.imdecode(np.frombuffer(data, np.uint8), REDUCED_FLAGS[factor])
+    if img_cv is None:  # formats OpenCV can't read
+        try:
+            with Image.open(BytesIO(data)) as im:
+                img_array = np.array(ImageOps.exif_transpose(im).convert('RGB'))
+        except OSError:  # truncated or corrupt pixel data
+            raise ValueError("This image is damaged and can't be decoded.") from None
+        img_cv = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+    return img_cv
+
+def ingest_image(data):
+    key = hashlib.blake2b(data, digest_size=16).hexdigest()
+    cache_key = stage_key(key, "ingest", WORKING_PIXELS)
+    img_cv = stage_cache.get(cache_key)
+    if img_cv is None:
+        with metrics.timed("ingest") as m:
+            img_cv = m.result = decode_image(data)
+        stage_cache.put(cache_key, img_cv)
+    # Downstream keys (stages, renders, encodes) derive from this one, so it has
+    # to carry the working resolution: processes sharing the disk cache may
+    # decode the same bytes at different sizes
+    register_source(img_cv, cache_key)
+    return img_cv
+
+
+# --- 4. CACHED PIPELINE ---
+# Each stage is keyed by its parent's key plus only its own parameters, so a
+# change further down the pipeline reuses every result above it.
+# With preview_width set, everything after decoding runs on a proxy scaled to
+# the display width, with kernel sizes scaled to match the full render.
+def geometry_stages(image, rotation, crop_vals, preview_width=None):
+    # 1. Convert (ingested uploads are already BGR)
+    def convert(img):
+        if isinstance(img, np.ndarray): return img
+        img_array = np.array(img.convert('RGB'))
+        return cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+    key, img_cv = run_stage(source_key(image), "convert", (), convert, image)
+
+    # 1b. Preview proxy
+    scale = proxy_scale(img_cv.shape, rotation, preview_width)
+    def proxy(img):
+        out = resize_image(img, scale)
+        if out is not img and file_backed(img):
+            img.base.madvise(mmap.MADV_DONTNEED)  # a spooled scan stays on disk once the proxy exists
+        return out
+    key, img_cv = run_stage(key, "proxy", (round(scale, 4),), proxy, img_cv)
+
+    # 2. Geometry
+    def geometry(img):
+        out = crop_image(rotate_image(img, rotation), *crop_vals)
+        if out is img: return img
+        out = np.ascontiguousarray(out)
+        # A top/bottom-only crop is still a view: copy it so the cache entry
+        # doesn't pin the whole upstream frame while charging only the crop
+        return out.copy() if out.base is not None else out
+    key, img_cv = run_stage(key, "geometry", (rotation % 4, tuple(crop_vals)), geometry, img_cv)
+    return key, img_cv, scale
+
+def apply_processing(image, rotation, crop_vals, mode, t1, t2, brightness, contrast, show_grid,
+                     preview_width=None, abstract_tier=None):
+    start = time.perf_counter()
+
+    # Full renders are also kept in the optional on-disk cache, shared by
+    # every server process on the node
+    tier = abstract_tier or ABSTRACT_TIER
+    render_key = None
+    if disk_cache is not None and not preview_width:
+        outline = (t1, t2) if mode == "Magic Outline" else (tier,) if mode == "Abstract" else ()
+        render_key = stage_key(source_key(image), "render", rotation % 4, tuple(crop_vals), mode, *outline,
+                               contrast, brightness, show_grid)
+        cached = disk_cache.get_array(render_key)
+        if cached is not None:
+            register_source(cached, render_key)
+            register_bit_depth(cached, output_format(mode, show_grid)[1])
+            metrics.record("render", time.perf_counter() - start, mode, shape=cached.shape, cached=True)
+            return cached
+
+    # 1-2. Convert, preview proxy, geometry
+    key, img_cv, scale = geometry_stages(image, rotation, crop_vals, preview_width)
+
+    if mode in POINT_MODES:
+        # 3-4. Enhance and filter fused into one pass
+        key, final_img = run_stage(key, "point", (mode, contrast, brightness),
+                                   lambda img: apply_point_ops(img, mode, contrast, brightness), img_cv, mode)
+    else:
+        # 3. Enhance
+        key, img_cv = run_stage(key, "enhance", (contrast, brightness),
+                                lambda img: adjust_brightness_contrast(img, contrast, brightness), img_cv)
+
+        # 4. Filter Logic
+        if mode == "Magic Outline":
+            # Gradients are cached per geometry/enhancement, so dragging the
+            # threshold sliders only reruns the hysteresis
+            key, grad = run_stage(key, "gradients", (), lambda img: outline_gradients(img, scale), img_cv, mode)
+            key, final_img = run_stage(key, "edges", (t1, t2), lambda g: outline_edges(g, t1, t2), grad, mode)
+        else:
+            style_params = (mode, tier) if mode == "Abstract" else (mode,)
+            key, final_img = run_stage(key, "style", style_params,
+                                       lambda img: apply_style(img, mode, t1, t2, scale, tier), img_cv, mode)
+
+    # 5. Grid
+    if show_grid:
+        key, final_img = run_stage(key, "grid", (), draw_grid, final_img, mode)
+
+    # Downstream caches (overlay encoding) key on the result without rehashing it.
+    # With default settings the result is the input itself, which must keep its
+    # content key: a pipeline key there would make every stage lookup miss.
+    if final_img is not image:
+        register_source(final_img, render_key or key)
+        register_bit_depth(final_img, output_format(mode, show_grid)[1])
+        if render_key is not None:
+            disk_cache.put_array(render_key, final_img)
+    metrics.record("preview" if preview_width else "render", time.perf_counter() - start, mode,
+                   shape=final_img.shape)
+    return final_img
+
+
+# --- 5. CONTACT SHEET ---
+# Thumbnails of every style in one pass, to pick a style with one click.
+# Geometry, enhancement and the grey conversion are computed (and cached)
+# once and shared; the style branches then run side by side on the tile pool.
+# Thumbnails are far below the tile size, so each branch calls its filter
+# directly rather than through run_tiled. The other styles match
+# apply_processing's preview exactly. Grayscale and Sepia come from the shared
+# enhanced image, so when apply_point_ops folds an affine brightness/contrast
+# into the colour mix they differ by one level (brightness 20, contrast 0.7:
+# 24% / 17% of pixels).
+CONTACT_WIDTH = int(os.environ.get("GLASS_CANVAS_CONTACT_WIDTH", "240"))
+
+def contact_sheet(image, rotation, crop_vals, t1, t2, brightness, contrast, width=CONTACT_WIDTH,
+                  abstract_tier=None):
+    start = time.perf_counter()
+    tier = abstract_tier or ABSTRACT_TIER
+    key, img_cv, scale = geometry_stages(image, rotation, crop_vals, width)
+    key, enhanced = run_stage(key, "enhance", (contrast, brightness),
+                              lambda img: adjust_brightness_contrast(img, contrast, brightness), img_cv)
+    gray_key, gray = run_stage(key, "gray", (), lambda img: cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), enhanced)
+
+    abstract = {"fast": abstract_fast, "balanced": abstract_balanced}.get(tier, abstract_filter)
+    branches = {
+        "Magic Outline": (gray_key, (t1, t2), lambda g: outline_edges(outline_gradients(g, scale), t1, t2), gray),
+        "Pencil Sketch": (gray_key, (), lambda g: pencil_sketch(g, scale), gray),
+        "Crayon Drawing": (key, (), lambda img: crayon_filter(img, scale), enhanced),
+        "Abstract": (key, (tier,), lambda img: abstract(img, scale), enhanced),
+        "Sepia": (key, (), lambda img: cv2.transform(img, SEPIA_KERNEL), enhanced),
+        "Negative": (key, (), cv2.bitwise_not, enhanced),
+    }
+
+    def branch(mode, parent_key, params, fn, src):
+        return run_stage(parent_key, "contact", (mode,) + params, fn, src, mode)[1]
+
+    # Each branch keeps this run's metrics context, like the render queue
+    pool = get_pool()
+    futures = {mode: pool.submit(contextvars.copy_context().run, branch, mode, *args)
+               for mode, args in branches.items()}
+    sheet = {"Original": enhanced, "Grayscale": gray}
+    sheet.update((mode, future.result()) for mode, future in futures.items())
+    metrics.record("contact-sheet", time.perf_counter() - start, shape=img_cv.shape)
+    return {mode: sheet[mode] for mode in STYLES}
@@ -0,0 +1,86 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+# --- BACKGROUND PREVIEW RENDERING ---
+# Step 2 submits previews to a shared executor instead of rendering inline.
+# Every submission bumps the session's generation counter: queued work for an
+# older generation is cancelled, work that is already running finishes but its
+# result is discarded, and each job waits DEBOUNCE_S before starting so a burst
+# of slider changes only renders the parameter set the user settled on.
+# At least two workers, so one stale render that is still running never blocks the next
+RENDER_WORKERS = int(os.environ.get("GLASS_CANVAS_RENDER_WORKERS", "0")) or max(2, os.cpu_count() or 1)
+DEBOUNCE_S = float(os.environ.get("GLASS_CANVAS_DEBOUNCE_MS", "120")) / 1000
+WAIT_S = float(os.environ.get("GLASS_CANVAS_RENDER_WAIT_MS", "400")) / 1000
+
+_executor = ThreadPoolExecutor(RENDER_WORKERS, thread_name_prefix="glass-render")
+
+
+class Renderer:
+    # One per session, kept in st.session_state
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.pending = None  # (generation, key, future)
+        self.latest = None   # (key, image) of the last render that was still current when it finished
+
+    def submit(self, key, fn):
+        with self._lock:
+            if self.pending is not None and self.pending[1] == key:
+                return self.pending[2]
+            # Any other key supersedes the pending job, even when it is the one
+            # already in `latest` (A -> B -> A): B must not land on top of A
+            if self.pending is not None:
+                self.pending[2].cancel()  # only succeeds if it hasn't started
+                self.pending = None
+                self.generation += 1
+            if self.latest is not None and self.latest[0] == key:
+                return None
+            self.generation += 1
+            generation = self.generation
+            # Carry the rerun's context so stage metrics land in its debug panel
+            future = _executor.submit(contextvars.copy_context().run, self._run, generation, key, fn)
+            self.pending = (generation, key, future)
+            return future
+
+    def _run(self, generation, key, fn):
+        time.sleep(DEBOUNCE_S)
+        if generation != self.generation:
+            return None  # superseded while debouncing
+        image = fn()
+        with self._lock:
+            if generation != self.generation:
+                return None  # superseded while rendering
+            self.latest = (key, image)
+            self.pending = None
+        return image
+
+    def render(self, key, fn, wait=WAIT_S):
+        # Returns (image, current): the newest finished preview, and whether it
+        # matches `key` or is a stale one to show while the new one renders
+        future = self.submit(key, fn)
+        if future is not None:
+            try:
+                future.result(timeout=wait)
+            except TimeoutError:
+                pass
+            except Exception:
+                # Surface the failure once; the next rerun with the same key renders again
+                with self._lock:
+                    if self.pending is not None and self.pending[2] is future:
+                        self.pending = None
+                raise
+        with self._lock:
+            latest = self.latest
+        if latest is None:
+            return None, False
+        return latest[1], latest[0] == key
+
+    def is_settled(self, key):
+        with self._lock:
+            if self.latest is not None and self.latest[0] == key:
+                return True
+            # A failed render also counts, so the next rerun can surface the error
+            return self.pending is not None and self.pending[1] == key and self.pending[2].done()
@@ -0,0 +1,197 @@
+import os
+import tempfile
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+
+# --- SESSION IMAGE STORE ---
+# Session images live here instead of st.session_state so their memory can be
+# accounted for. When a session or the whole process goes over budget, the
+# least recently used arrays are spilled to .npy files and memory-mapped back
+# in on next access. Spilled arrays are read-only, so a file written once can
+# be dropped and re-mapped any number of times. Black-and-white images
+# (processing.bit_depth == 1, e.g. Magic Outline) are kept packed 8 pixels
+# to a byte and unpacked on access.
+# Ingested uploads and renders are the same objects processing.stage_cache
+# holds, so whenever an array is spilled, packed or released here its stage
+# cache entries go too; otherwise the budgets would not bound resident memory.
+SESSION_BUDGET_BYTES = int(os.environ.get("GLASS_CANVAS_SESSION_MB", "256")) * 1024 * 1024
+GLOBAL_BUDGET_BYTES = int(os.environ.get("GLASS_CANVAS_MEMORY_MB", "2048")) * 1024 * 1024
+SPILL_DIR = os.environ.get("GLASS_CANVAS_SPILL_DIR", os.path.join(tempfile.gettempdir(), "glass-canvas-spill"))
+
+
+class _Entry:
+    __slots__ = ("array", "path", "key", "nbytes", "width", "unpacked")
+
+    def __init__(self, array, key, width=None):
+        self.array = array
+        self.path = None
+        self.key = key
+        self.nbytes = array.nbytes
+        self.width = width        # set for packed 1-bit entries
+        self.unpacked = None      # weakref to the last full array handed out
+
+
+def _pack(array):
+    import numpy as np
+    return np.packbits(array, axis=-1)  # any non-zero sample is white
+
+def _uncache(array):
+    from processing import stage_cache
+    stage_cache.discard_value(array)
+
+def _unpack(entry):
+    import numpy as np
+    from processing import register_bit_depth, register_source
+    array = entry.unpacked() if entry.unpacked is not None else None
+    if array is None:
+        array = np.unpackbits(entry.array, axis=-1, count=entry.width)
+        array *= 255
+        array.setflags(write=False)
+        register_source(array, entry.key)
+        register_bit_depth(array, 1)
+        entry.unpacked = weakref.ref(array)
+    return array
+
+
+class SessionImageStore:
+    def __init__(self, session_budget, global_budget, spill_dir):
+        self.session_budget = session_budget
+        self.global_budget = global_budget
+        self.spill_dir = spill_dir
+        self._entries = OrderedDict()  # (session_id, name) -> _Entry, least recently used first
+        self._lock = threading.Lock()
+        self._resident = {}  # session_id -> bytes held in memory
+        self.bytes = 0
+        self.spills = 0
+        self.faults = 0
+
+    def put(self, session_id, name, array):
+        from processing import bit_depth, file_backed, source_key  # imported lazily: pulls in cv2
+        key = source_key(array)  # free for pipeline outputs, which are pre-registered
+        array.setflags(write=False)
+        if file_backed(array):
+            # Already on disk (large uploads and their renders, see streaming):
+            # costs no budget and is never packed or spilled again
+            entry = _Entry(array, key)
+            entry.nbytes = 0
+        elif bit_depth(array) == 1:
+            entry = _Entry(_pack(array), key, width=array.shape[-1])
+            entry.unpacked = weakref.ref(array)  # callers still holding it get it back as is
+            _uncache(array)
+        else:
+            entry = _Entry(array, key)
+        with self._lock:
+            old = self._entries.get((session_id, name))
+            if old is not None and old.array is entry.array:
+                self._entries.move_to_end((session_id, name))  # same array again: keep its cache entries
+                return
+            self._drop((session_id, name))
+            self._entries[(session_id, name)] = entry
+            self._charge(session_id, entry.nbytes)
+            self._enforce(session_id, keep=(session_id, name))
+
+    def get(self, session_id, name):
+        with self._lock:
+            entry = self._entries.get((session_id, name))
+            if entry is None:
+                return None
+            self._entries.move_to_end((session_id, name))
+            if entry.array is None:
+                import numpy as np
+                from processing import register_source
+                entry.array = np.load(entry.path, mmap_mode="r")
+                if entry.width is None:
+                    register_source(entry.array, entry.key)
+                self.faults += 1
+                self._charge(session_id, entry.nbytes)
+                self._enforce(session_id, keep=(session_id, name))
+            return entry.array if entry.width is None else _unpack(entry)
+
+    def discard(self, session_id, name):
+        with self._lock:
+            self._drop((session_id, name))
+
+    def release(self, session_id):
+        with self._lock:
+            for k in [k for k in self._entries if k[0] == session_id]:
+                self._drop(k)
+            self._resident.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len({k[0] for k in self._entries}),
+                "entries": len(self._entries),
+                "spilled": sum(1 for e in self._entries.values() if e.array is None),
+                "bytes": self.bytes,
+                "packed": sum(1 for e in self._entries.values() if e.width is not None),
+                "global_budget": self.global_budget,
+                "session_budget": self.session_budget,
+                "spills": self.spills,
+                "faults": self.faults,
+            }
+
+    def _charge(self, session_id, nbytes):
+        self._resident[session_id] = self._resident.get(session_id, 0) + nbytes
+        self.bytes += nbytes
+
+    def _drop(self, k):
+        entry = self._entries.pop(k, None)
+        if entry is None:
+            return
+        if entry.array is not None:
+            self._charge(k[0], -entry.nbytes)
+            _uncache(entry.array)
+        if entry.path is not None:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _enforce(self, session_id, keep):
+        for k, entry in list(self._entries.items()):
+            global_over = self.bytes > self.global_budget
+            session_over = self._resident.get(session_id, 0) > self.session_budget
+            if not (global_over or session_over):
+                break
+            if k == keep or entry.array is None or not entry.nbytes:
+                continue
+            if global_over or k[0] == session_id:
+                self._spill(k, entry)
+
+    def _spill(self, k, entry):
+        if entry.path is None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            entry.path = os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.npy")
+            import numpy as np
+            np.save(entry.path, entry.array)
+        _uncache(entry.array)
+        entry.array = None
+        self._charge(k[0], -entry.nbytes)
+        self.spills += 1
+
+
+store = SessionImageStore(SESSION_BUDGET_BYTES, GLOBAL_BUDGET_BYTES, SPILL_DIR)
+
+
+class SessionImages:
+    # Kept in st.session_state. Streamlit drops a session's state when the
+    # session expires, which garbage-collects this handle and frees its images.
+    def __init__(self, store=store):
+        self.store = store
+        self.session_id = uuid.uuid4().hex
+        weakref.finalize(self, store.release, self.session_id)
+
+    def get(self, name):
+        return self.store.get(self.session_id, name)
+
+    def put(self, name, array):
+        self.store.put(self.session_id, name, array)
+
+    def discard(self, name):
+        self.store.discard(self.session_id, name)
+
+    def clear(self):
+        self.store.release(self.session_id)
@@ -0,0 +1,138 @@
+import os
+import threading
+import uuid
+
+import numpy as np
+
+# --- CROSS-SESSION SHARING ---
+# Cache keys are content hashes, so identical uploads from different sessions
+# (a class all tracing the same reference) land on the same entries. SingleFlight
+# makes concurrent requests for one key wait for a single computation, and
+# DiskCache optionally keeps full renders and encoded overlays on local disk,
+# shared by every server process on the node.
+DISK_CACHE_DIR = os.environ.get("GLASS_CANVAS_DISK_CACHE_DIR")
+DISK_CACHE_BYTES = int(os.environ.get("GLASS_CANVAS_DISK_CACHE_MB", "2048")) * 1024 * 1024
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        # Returns (value, leader); followers get the leader's value or error
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, False
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.value, True
+
+
+class DiskCache:
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key, ext):
+        return os.path.join(self.path, f"{key}.{ext}")
+
+    def _touch(self, path):
+        try:
+            os.utime(path)  # mtime doubles as the LRU clock across processes
+            self.hits += 1
+            return True
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+
+    def _write(self, path, write):
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        write(tmp)
+        os.replace(tmp, path)  # readers never see a partial file
+        self.prune()
+
+    def get_array(self, key):
+        path = self._file(key, "npy")
+        if not self._touch(path):
+            return None
+        try:
+            return np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError):  # pruned or truncated by another process
+            return None
+
+    def put_array(self, key, array):
+        def write(tmp):
+            with open(tmp, "wb") as f:
+                np.save(f, array)
+        self._write(self._file(key, "npy"), write)
+
+    def get_bytes(self, key):
+        path = self._file(key, "bin")
+        if not self._touch(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put_bytes(self, key, data):
+        def write(tmp):
+            with open(tmp, "wb") as f:
+                f.write(data)
+        self._write(self._file(key, "bin"), write)
+
+    def prune(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        return {"path": self.path, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+
+flight = SingleFlight()
+disk_cache = DiskCache(DISK_CACHE_DIR, DISK_CACHE_BYTES) if DISK_CACHE_DIR else None
@@ -0,0 +1,403 @@
+import mmap
+import os
+import struct
+import tempfile
+import time
+import uuid
+import weakref
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import metrics
+import processing
+
+# --- OUT-OF-CORE PIPELINE ---
+# apply_processing holds several full-frame copies at once, which for 100+ MP
+# mural scans means gigabytes per render. Here the image is read, transformed
+# and filtered in row strips (padded by the style's halo) and written through a
+# memory-mapped TIFF. Pages of the source and output mappings are dropped after
+# every strip, so peak RSS follows the strip budget, not the image size.
+# That bound holds only for uncompressed sources (TIFF, BMP, PPM) mapped by
+# map_raw. JPEG and PNG are decoded whole once by spool_decoded, so peak RSS
+# is one full frame plus the strip budget. Large app uploads take the same
+# path (see LARGE UPLOADS IN THE APP below).
+#   python batch.py scans/ -o murals/ --style "Pencil Sketch" --stream --workers 1
+STREAM_BUDGET_BYTES = int(os.environ.get("GLASS_CANVAS_STREAM_MB", "512")) * 1024 * 1024
+STREAM_DIR = os.environ.get("GLASS_CANVAS_STREAM_DIR", os.path.join(tempfile.gettempdir(), "glass-canvas-stream"))
+
+# Copies of a strip alive at once: source block, enhanced copy, filter temporaries, result
+STRIP_COPIES = 8
+MIN_STRIP_ROWS = 16
+RAW_MODES = {"RGB": 3, "BGR": 3, "L": 1}
+
+
+class MappedImage:
+    # A raw uint8 pixel buffer inside a file, mapped rather than loaded.
+    # `row_stride` covers padded rows (BMP); negative `flip` means bottom-up rows.
+    def __init__(self, path, shape, offset=0, row_stride=None, writable=False, flip=False):
+        self.shape = shape
+        self.channels = shape[2] if len(shape) > 2 else 1
+        self.row_stride = row_stride or shape[1] * self.channels
+        self.flip = flip
+        self._file = open(path, "r+b" if writable else "rb")
+        self._writable = writable
+        # mmap offsets must be aligned; the array starts a little way in
+        self._start = offset % mmap.ALLOCATIONGRANULARITY
+        length = self._start + self.row_stride * shape[0]
+        self._map = mmap.mmap(self._file.fileno(), length, offset=offset - self._start,
+                              access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        self.array = np.ndarray(shape, np.uint8, buffer=self._map, offset=self._start,
+                                strides=(self.row_stride, self.channels, 1)[:len(shape)])
+
+    def rows(self, y0, y1):
+        # Stored rows backing image rows y0:y1
+        h = self.shape[0]
+        return (h - y1, h - y0) if self.flip else (y0, y1)
+
+    def release(self, y0=0, y1=None):
+        # Write back and drop the pages behind rows y0:y1 (in storage order)
+        y1 = self.shape[0] if y1 is None else y1
+        lo = self._start + y0 * self.row_stride
+        hi = self._start + y1 * self.row_stride
+        lo -= lo % mmap.PAGESIZE
+        if hi <= lo: return
+        if self._writable:
+            self._map.flush(lo, hi - lo)
+        self._map.madvise(mmap.MADV_DONTNEED, lo, hi - lo)
+
+    def close(self):
+        self.array = None
+        if self._writable:
+            self._map.flush()
+        self._map.close()
+        self._file.close()
+
+
+class StripSource:
+    # Reads rectangles of a mapped source as contiguous BGR copies, a few rows
+    # at a time, dropping the mapped pages as it goes
+    def __init__(self, image, order, chunk_bytes):
+        self.image = image
+        self.order = order
+        self.shape = image.shape[:2]
+        self.chunk_rows = max(1, chunk_bytes // image.row_stride)
+
+    def read(self, y0, y1, x0, x1):
+        out = np.empty((y1 - y0, x1 - x0, 3), np.uint8)
+        for c0 in range(y0, y1, self.chunk_rows):
+            c1 = min(y1, c0 + self.chunk_rows)
+            s0, s1 = self.image.rows(c0, c1)
+            block = self.image.array[s0:s1, x0:x1]
+            if self.image.flip:
+                block = block[::-1]
+            dst = out[c0 - y0:c1 - y0]
+            if self.order == "L":
+                cv2.cvtColor(np.ascontiguousarray(block), cv2.COLOR_GRAY2BGR, dst=dst)
+            elif self.order == "RGB":
+                dst[:] = block[..., ::-1]
+            else:
+                dst[:] = block
+            del block
+            self.image.release(s0, s1)
+        return out
+
+    def close(self):
+        self.image.close()
+
+
+def map_raw(path):
+    # Row-addressable sources (uncompressed TIFF, PPM/PGM, BMP) are mapped in
+    # place; anything compressed or rotated by EXIF returns None
+    with Image.open(path) as im:
+        w, h = im.size
+        tiles = im.tile
+        orientation = im.getexif().get(0x0112, 1)
+    if not tiles or orientation != 1:
+        return None
+    _, _, offset, args = tiles[0]
+    rawmode, stride, flip = (tuple(args) + (0, 1))[:3] if isinstance(args, tuple) else (args, 0, 1)
+    if any(t[0] != "raw" for t in tiles) or rawmode not in RAW_MODES:
+        return None
+    channels = RAW_MODES[rawmode]
+    stride = stride or w * channels
+    # Striped TIFFs are fine as long as the strips are stored back to back
+    for tile in tiles:
+        (_, y0, _, y1), tile_offset = tile[1], tile[2]
+        if tile[1][0] != 0 or tile[1][2] != w or tile_offset != offset + y0 * stride or tile[3] != tiles[0][3]:
+            return None
+    shape = (h, w, channels) if channels > 1 else (h, w)
+    return MappedImage(path, shape, offset, row_stride=stride, flip=flip < 0), rawmode
+
+
+def spool_decoded(path):
+    # Compressed inputs have to be decoded whole once: the one full frame this
+    # path holds, so their peak RSS is not bounded by the strip budget. The
+    # pixels are then spooled to disk and mapped like a raw source.
+    processing.read_header(path)
+    img_cv = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img_cv is None:
+        raise ValueError(f"Could not read {path}")
+    os.makedirs(STREAM_DIR, exist_ok=True)
+    spool = os.path.join(STREAM_DIR, f"{uuid.uuid4().hex}.raw")
+    img_cv.tofile(spool)
+    shape = img_cv.shape
+    del img_cv
+    return MappedImage(spool, shape), spool
+
+
+def open_source(path, budget):
+    chunk = max(budget // 16, 1024 * 1024)
+    raw = map_raw(path)
+    if raw is not None:
+        image, order = raw
+        return StripSource(image, order, chunk), None
+    image, spool = spool_decoded(path)
+    return StripSource(image, "BGR", chunk), spool
+
+
+def create_tiff(path, h, w, channels, bits=8):
+    # Baseline uncompressed single-strip TIFF; returns the pixel data offset.
+    # bits=1 is a bilevel image, each row packed to whole bytes.
+    nbytes = h * ((w * channels * bits + 7) // 8)
+    if nbytes > 0xFFFFFFFF - 4096:
+        raise ValueError("Output is over 4 GB, which classic TIFF cannot address.")
+    count = 10
+    ifd_end = 8 + 2 + count * 12 + 4
+    bps_offset = ifd_end
+    data_offset = bps_offset + 2 * channels
+    data_offset += -data_offset % 16
+    bps = (3, channels, bps_offset) if channels > 1 else (3, 1, bits)
+    entries = [
+        (256, 4, 1, w), (257, 4, 1, h), (258,) + bps, (259, 3, 1, 1),
+        (262, 3, 1, 2 if channels > 1 else 1), (273, 4, 1, data_offset),
+        (277, 3, 1, channels), (278, 4, 1, h), (279, 4, 1, nbytes), (284, 3, 1, 1),
+    ]
+    with open(path, "wb") as f:
+        f.write(b"II*\x00" + struct.pack("<I", 8) + struct.pack("<H", count))
+        for tag, typ, n, value in entries:
+            if typ == 3 and n == 1:
+                f.write(struct.pack("<HHIHH", tag, typ, n, value, 0))
+            else:
+                f.write(struct.pack("<HHII", tag, typ, n, value))
+        f.write(struct.pack("<I", 0))
+        if channels > 1:
+            f.write(struct.pack(f"<{channels}H", *([8] * channels)))
+        f.truncate(data_offset + nbytes)
+    return data_offset
+
+
+def source_rect(k, h, w, r0, r1, c0, c1):
+    # Source rectangle that np.rot90(source, k)[r0:r1, c0:c1] is drawn from
+    k %= 4
+    if k == 0: return r0, r1, c0, c1
+    if k == 1: return c0, c1, w - r1, w - r0
+    if k == 2: return h - r1, h - r0, w - c1, w - c0
+    return h - c1, h - c0, r0, r1
+
+
+def crop_box(h, w, left_p, right_p, top_p, bottom_p):
+    # processing.crop_image's rectangle, without touching pixels
+    x_start, x_end = int(w * (left_p / 100)), int(w * (1 - right_p / 100))
+    y_start, y_end = int(h * (top_p / 100)), int(h * (1 - bottom_p / 100))
+    if x_start >= x_end or y_start >= y_end: return 0, h, 0, w
+    return y_start, y_end, x_start, x_end
+
+
+def strip_rows(width, halo, budget, align=2):
+    rows = budget // (STRIP_COPIES * width * 3) - 2 * halo
+    rows = max(MIN_STRIP_ROWS, rows)
+    return rows - rows % align  # aligned offsets keep mean shift's pyramid on the same grid (style_align)
+
+
+class StripReader:
+    # Output-space strips of the rotated, cropped source, padded by `halo` rows
+    def __init__(self, source, rotation, crop_vals):
+        self.source = source
+        self.rotation = rotation % 4
+        h, w = source.shape
+        rh, rw = (h, w) if self.rotation % 2 == 0 else (w, h)
+        self.y_start, y_end, self.x_start, self.x_end = crop_box(rh, rw, *crop_vals)
+        self.shape = (y_end - self.y_start, self.x_end - self.x_start)
+
+    def strips(self, rows, halo=0):
+        oh = self.shape[0]
+        h, w = self.source.shape
+        for y0 in range(0, oh, rows):
+            y1 = min(oh, y0 + rows)
+            py0, py1 = max(0, y0 - halo), min(oh, y1 + halo)
+            sy0, sy1, sx0, sx1 = source_rect(self.rotation, h, w, self.y_start + py0, self.y_start + py1,
+                                             self.x_start, self.x_end)
+            block = np.ascontiguousarray(np.rot90(self.source.read(sy0, sy1, sx0, sx1), self.rotation))
+            yield y0, y1, py0, block
+
+
+def stream_palette(reader, rows, brightness, contrast):
+    # The fast Abstract tier posterizes to one global palette; build it from the
+    # same thumbnail abstract_fast would use, assembled strip by strip
+    step = processing.palette_step(*reader.shape)
+    parts = [block[-y0 % step::step, ::step] for y0, _, _, block in reader.strips(rows)]
+    thumb = processing.adjust_brightness_contrast(np.vstack(parts), contrast, brightness)
+    return processing.abstract_palette(processing.smooth_for_palette(thumb, 1 / step))
+
+
+def render_strip(block, mode, t1, t2, brightness, contrast, tier="quality", palette=None):
+    # Same stages as apply_processing's full render, on one padded strip
+    if mode in processing.POINT_MODES:
+        return processing.apply_point_ops(block, mode, contrast, brightness)
+    block = processing.adjust_brightness_contrast(block, contrast, brightness)
+    if palette is not None:
+        return processing.abstract_fast(block, palette=palette)
+    return processing.apply_style(block, mode, t1, t2, tier=tier)
+
+
+def render_strips(reader, mode, t1, t2, brightness, contrast, show_grid, budget, tier):
+    # Yields (y0, y1, strip) down the output, grid lines drawn in
+    oh, ow = reader.shape
+    align = processing.style_align(mode, tier)
+    halo = processing.style_halo(mode, tier=tier)
+    halo += -halo % align
+    rows = strip_rows(ow, halo, budget, align)
+    xs, ys = processing.grid_lines(oh, ow) if show_grid else ([], [])
+    palette = None
+    if mode == "Abstract" and tier == "fast":
+        palette = stream_palette(reader, rows, brightness, contrast)
+
+    for y0, y1, py0, block in reader.strips(rows, halo):
+        strip = render_strip(block, mode, t1, t2, brightness, contrast, tier, palette)[y0 - py0:y1 - py0]
+        del block
+        if xs or ys:
+            strip = np.array(strip)
+            color = (100, 255, 100) if strip.ndim > 2 else 180
+            strip[:, xs] = color
+            for y in ys:
+                if y0 <= y < y1: strip[y - y0] = color
+        yield y0, y1, strip
+
+
+def stream_render(src_path, dst_path, rotation, crop_vals, mode, t1, t2, brightness, contrast, show_grid,
+                  budget=None, abstract_tier=None):
+    start = time.perf_counter()
+    budget = budget or STREAM_BUDGET_BYTES
+    tier = abstract_tier or processing.ABSTRACT_TIER
+    source, spool = open_source(src_path, budget)
+    out = None
+    try:
+        reader = StripReader(source, rotation, crop_vals)
+        oh, ow = reader.shape
+        channels, bits = processing.output_format(mode, show_grid)
+        for y0, y1, strip in render_strips(reader, mode, t1, t2, brightness, contrast, show_grid, budget, tier):
+            if out is None:
+                offset = create_tiff(dst_path, oh, ow, channels, bits)
+                shape = (oh, (ow + 7) // 8) if bits == 1 else (oh, ow, channels) if channels > 1 else (oh, ow)
+                out = MappedImage(dst_path, shape, offset, writable=True)
+            # TIFF stores RGB
+            dst = out.array[y0:y1]
+            if strip.ndim > 2:
+                cv2.cvtColor(strip, cv2.COLOR_BGR2RGB, dst=dst)
+            elif bits == 1:
+                dst[:] = np.packbits(strip, axis=1)  # BlackIsZero: white packs to 1
+            else:
+                dst[:] = strip
+            del dst, strip
+            out.release(y0, y1)
+    finally:
+        if out is not None:
+            out.close()
+        source.close()
+        if spool:
+            os.remove(spool)
+    metrics.record("stream", time.perf_counter() - start, mode, shape=(oh, ow))
+    return oh, ow
+
+
+# --- LARGE UPLOADS IN THE APP ---
+# JPEG and PNG can't be decoded in strips, so an upload over APP_STREAM_PIXELS
+# is decoded once and then moved straight to a spool file that the session
+# only ever maps. Step 2 reads it through the preview proxy stage, which drops
+# the mapped pages again, and the full render streams strips into a mapped
+# .npy that step 3 reads. Peak RSS is one decoded frame while uploading, then
+# the strip budget, instead of the several frames apply_processing holds.
+APP_STREAM_PIXELS = int(float(os.environ.get("GLASS_CANVAS_APP_STREAM_MP", "40")) * 1_000_000)
+
+_streamed = weakref.WeakValueDictionary()  # render key -> mapped result still in use
+
+
+def create_npy(path, shape):
+    # .npy of uint8 pixels, contents left to be filled; returns the data offset
+    with open(path, "wb") as f:
+        np.lib.format.write_array_header_1_0(f, {"descr": "|u1", "fortran_order": False, "shape": shape})
+        offset = f.tell()
+        f.truncate(offset + int(np.prod(shape)))
+    return offset
+
+def _spool_path():
+    os.makedirs(STREAM_DIR, exist_ok=True)
+    return os.path.join(STREAM_DIR, f"{uuid.uuid4().hex}.npy")
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _map_spooled(path, key, bits=None):
+    # Read-only map registered like any pipeline array; the file goes with it
+    mapped = np.load(path, mmap_mode="r")
+    weakref.finalize(mapped, _remove, path)
+    processing.register_source(mapped, key)
+    if bits is not None:
+        processing.register_bit_depth(mapped, bits)
+    return mapped
+
+def spool_upload(image):
+    # Swaps a decoded upload for a map of it; the caller drops the original
+    key = processing.source_key(image)
+    processing.stage_cache.discard_value(image)
+    path = _spool_path()
+    np.save(path, image)
+    return _map_spooled(path, key)
+
+def stream_array(image, rotation, crop_vals, mode, t1, t2, brightness, contrast, show_grid,
+                 budget=None, abstract_tier=None):
+    # stream_render for a mapped image, into a mapped .npy instead of a TIFF
+    start = time.perf_counter()
+    budget = budget or STREAM_BUDGET_BYTES
+    tier = abstract_tier or processing.ABSTRACT_TIER
+    key = processing.stage_key(processing.source_key(image), "stream", rotation % 4, tuple(crop_vals), mode,
+                               t1, t2, brightness, contrast, show_grid, tier)
+    cached = _streamed.get(key)
+    if cached is not None:
+        return cached
+
+    mapped = MappedImage(image.filename, image.shape, image.offset)
+    source = StripSource(mapped, "BGR" if mapped.channels == 3 else "L", max(budget // 16, 1024 * 1024))
+    path = _spool_path()
+    out = None
+    try:
+        reader = StripReader(source, rotation, crop_vals)
+        oh, ow = reader.shape
+        channels, bits = processing.output_format(mode, show_grid)
+        shape = (oh, ow, channels) if channels > 1 else (oh, ow)
+        out = MappedImage(path, shape, create_npy(path, shape), writable=True)
+        for y0, y1, strip in render_strips(reader, mode, t1, t2, brightness, contrast, show_grid, budget, tier):
+            out.array[y0:y1] = strip
+            del strip
+            out.release(y0, y1)
+    except BaseException:
+        _remove(path)
+        raise
+    finally:
+        if out is not None:
+            out.close()
+        source.close()
+    metrics.record("stream", time.perf_counter() - start, mode, shape=(oh, ow))
+    result = _streamed[key] = _map_spooled(path, key, bits)
+    return result
+
+def render_full(image, *params, abstract_tier=None):
+    # The app's full-resolution render: mapped (spooled) images stream in strips
+    if processing.file_backed(image):
+        return stream_array(image, *params, abstract_tier=abstract_tier)
+    return processing.apply_processing(image, *params, abstract_tier=abstract_tier)
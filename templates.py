@@ -0,0 +1,128 @@
+# --- STATIC PAGE ASSETS ---
+# Streamlit re-executes app.py on every interaction; these strings are built
+# once per process and only the dynamic parts are filled in at render time.
+APP_CSS = """
+    <style>
+        /* Import Fonts */
+        @import url('https://fonts.googleapis.com/css2?family=Space+Grotesk:wght@300;500;700&family=Reenie+Beanie&display=swap');
+        
+        /* Main Background */
+        .stApp {
+            background: radial-gradient(circle at 50% 10%, #2b2146 0%, #1a1625 40%, #000000 100%);
+            font-family: 'Space Grotesk', sans-serif;
+            color: #e0e0e0;
+        }
+
+        /* Titles & Headers */
+        h1 {
+            font-family: 'Space Grotesk', sans-serif;
+            font-weight: 700;
+            color: white;
+            text-align: center;
+            letter-spacing: 2px;
+            text-shadow: 0 0 20px rgba(139, 92, 246, 0.5);
+            margin-bottom: 0.5rem;
+        }
+        .artistic-sub {
+            font-family: 'Reenie Beanie', cursive;
+            color: #a78bfa;
+            font-size: 2rem;
+            text-align: center;
+            transform: rotate(-2deg);
+            margin-bottom: 2rem;
+        }
+
+        /* Glass Cards */
+        .glass-panel {
+            background: rgba(255, 255, 255, 0.03);
+            backdrop-filter: blur(16px);
+            -webkit-backdrop-filter: blur(16px);
+            border: 1px solid rgba(255, 255, 255, 0.08);
+            border-radius: 24px;
+            padding: 30px;
+            box-shadow: 0 8px 32px 0 rgba(0, 0, 0, 0.3);
+            margin-bottom: 20px;
+        }
+
+        /* Custom Buttons */
+        .stButton>button {
+            width: 100%;
+            border-radius: 12px;
+            font-weight: 600;
+            background: linear-gradient(135deg, #6366f1 0%, #8b5cf6 100%);
+            color: white;
+            border: none;
+            padding: 0.6rem 1rem;
+            transition: all 0.3s ease;
+            box-shadow: 0 4px 15px rgba(99, 102, 241, 0.3);
+        }
+        .stButton>button:hover {
+            transform: translateY(-2px);
+            box-shadow: 0 6px 20px rgba(99, 102, 241, 0.5);
+        }
+        /* Secondary Button Style (for 'Back') */
+        div[data-testid="stHorizontalBlock"] > div:first-child button {
+            background: transparent;
+            border: 1px solid rgba(255,255,255,0.2);
+            color: #cbd5e1;
+        }
+
+        /* Progress Bar Container */
+        .progress-container {
+            display: flex;
+            justify-content: space-between;
+            margin-bottom: 30px;
+            position: relative;
+            max-width: 600px;
+            margin-left: auto;
+            margin-right: auto;
+        }
+        .step-dot {
+            width: 30px;
+            height: 30px;
+            background: rgba(255,255,255,0.1);
+            border-radius: 50%;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            font-weight: bold;
+            z-index: 2;
+            transition: all 0.5s ease;
+        }
+        .step-active {
+            background: #8b5cf6;
+            box-shadow: 0 0 15px #8b5cf6;
+            transform: scale(1.2);
+        }
+        .step-line {
+            position: absolute;
+            top: 50%;
+            left: 0;
+            width: 100%;
+            height: 2px;
+            background: rgba(255,255,255,0.1);
+            z-index: 1;
+            transform: translateY(-50%);
+        }
+        
+        /* Remove extra padding */
+        .block-container { padding-top: 2rem; }
+    </style>
+"""
+
+_PROGRESS_TEMPLATE = """
+    <div class="progress-container">
+        <div class="step-line"></div>
+        <div class="step-dot {s1}">1</div>
+        <div class="step-dot {s2}">2</div>
+        <div class="step-dot {s3}">3</div>
+    </div>
+"""
+
+
+def _progress_html(step):
+    active = ["step-active" if step >= n else "" for n in (1, 2, 3)]
+    return _PROGRESS_TEMPLATE.format(s1=active[0], s2=active[1], s3=active[2])
+
+
+PROGRESS_HTML = {step: _progress_html(step) for step in (1, 2, 3)}
@@ -0,0 +1,60 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# OpenCV releases the GIL inside its filters, so a thread pool is enough to
+# spread one large image across every core without pickling tiles.
+WORKERS = int(os.environ.get("GLASS_CANVAS_WORKERS", "0")) or (os.cpu_count() or 1)
+TILE_SIZE = int(os.environ.get("GLASS_CANVAS_TILE", "512"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(workers=None):
+    global _pool
+    workers = workers or WORKERS
+    with _pool_lock:
+        if _pool is None or _pool._max_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="glass-tile")
+        return _pool
+
+
+def tile_grid(h, w, tile_size):
+    for y in range(0, h, tile_size):
+        for x in range(0, w, tile_size):
+            yield y, min(y + tile_size, h), x, min(x + tile_size, w)
+
+
+def run_tiled(fn, image, halo, tile_size=None, workers=None, align=2):
+    # Each tile is padded by `halo` pixels of real neighbourhood (clipped at the
+    # image border), filtered, then cropped back, so the seams see exactly the
+    # context the monolithic filter would.
+    workers = workers or WORKERS
+    # Aligned offsets keep pyramid-based filters (mean shift) on the same grid
+    # (processing.style_align), and tiles stay large relative to the halo so padding
+    # overhead is small
+    halo += -halo % align
+    tile_size = max(tile_size or TILE_SIZE, 8 * halo)
+    tile_size += -tile_size % align
+    h, w = image.shape[:2]
+    if workers == 1 or (h <= tile_size and w <= tile_size):
+        return fn(image)
+
+    def work(bounds):
+        y0, y1, x0, x1 = bounds
+        py0, py1 = max(0, y0 - halo), min(h, y1 + halo)
+        px0, px1 = max(0, x0 - halo), min(w, x1 + halo)
+        result = fn(image[py0:py1, px0:px1])
+        return bounds, result[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+
+    out = None
+    for (y0, y1, x0, x1), tile in get_pool(workers).map(work, tile_grid(h, w, tile_size)):
+        if out is None:
+            out = np.empty((h, w) + tile.shape[2:], dtype=tile.dtype)
+        out[y0:y1, x0:x1] = tile
+    return out